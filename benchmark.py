@@ -0,0 +1,281 @@
+# ========= SMART CANTEEN LUNCH-RUSH BENCHMARK =========
+# Seeds a throwaway canteen database with realistic history, then replays a
+# mixed student/staff workload against the real database.py functions from
+# several threads and prints a JSON report (throughput, latency percentiles
+# and lock errors per function). Run it on two commits and compare the JSON.
+#
+#   python benchmark.py --threads 40 --duration 30 --output bench.json
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+
+import database as db
+
+ITEM_NAMES = ["Veg Burger", "Paneer Roll", "Masala Dosa", "Idli Sambar", "Cold Coffee", "Tea",
+              "French Fries", "Veg Sandwich", "Margherita Pizza", "Chole Bhature", "Pav Bhaji", "Lassi"]
+CATEGORIES = ["Snacks", "Main Course", "Beverages", "South Indian", "Desserts"]
+PAYMENT_METHODS = ["Cash", "UPI/QR Code"]
+# Lunch-heavy distribution of order hours
+ORDER_HOURS = [8, 9, 10, 11, 12, 12, 12, 13, 13, 13, 13, 14, 14, 15, 16, 17, 18]
+
+# (operation, weight) of the replayed workload
+WORKLOAD = [
+    ("get_menu_items", 35),
+    ("get_orders", 20),
+    ("place_order", 15),
+    ("has_feedback", 10),
+    ("get_pending_feedback_order", 5),
+    ("update_order_status", 10),
+    ("get_orders.kitchen", 5),
+    ("search_menu", 5),
+]
+
+# ---------------- SEED ----------------
+def seed_database(path, users, menu_items, months, orders_per_day, rng):
+    db.close_connections()
+    db.DB_PATH = path
+    for stale in (path, db.archive_path()):
+        if os.path.exists(stale):
+            os.remove(stale)
+    db.init_db()
+
+    with db.write_transaction() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM menu")
+        c.executemany("INSERT INTO menu (name, price, stock, category, description) VALUES (?, ?, ?, ?, ?)", [
+            (f"{ITEM_NAMES[i % len(ITEM_NAMES)]} #{i + 1}", float(rng.choice(range(20, 200, 5))), 10**7,
+             CATEGORIES[i % len(CATEGORIES)], "Seeded benchmark item")
+            for i in range(menu_items)
+        ])
+        c.execute("SELECT id, name, price FROM menu")
+        menu = c.fetchall()
+
+        c.executemany("INSERT INTO users (username, password, role, name, mobile) VALUES (?, ?, ?, ?, ?)", [
+            (f"student{i}", db.hash_password("pass"), "student", f"Student {i}", f"9{i:09d}")
+            for i in range(users)
+        ])
+        c.execute("SELECT id FROM users WHERE role = 'student'")
+        user_ids = [row[0] for row in c.fetchall()]
+
+        orders, items, feedback = [], [], []
+        order_id = 0
+        start = datetime.datetime.now() - datetime.timedelta(days=30 * months)
+        for day in range(30 * months):
+            date = start + datetime.timedelta(days=day)
+            for _ in range(orders_per_day):
+                order_id += 1
+                user_id = rng.choice(user_ids)
+                when = date.replace(hour=rng.choice(ORDER_HOURS), minute=rng.randrange(60), second=rng.randrange(60))
+                lines = [(rng.choice(menu), rng.randint(1, 3)) for _ in range(rng.randint(1, 4))]
+                total = sum(item[2] * qty for item, qty in lines)
+                status = "Cancelled" if rng.random() < 0.02 else "Completed"
+                orders.append((order_id, user_id, f"Student {user_id}", "0000000000",
+                               when.strftime("%Y-%m-%d %H:%M:%S"), total, status,
+                               rng.choice(PAYMENT_METHODS), "CASH"))
+                items.extend((order_id, item[1], item[2], qty) for item, qty in lines)
+                if status == "Completed" and rng.random() < 0.6:
+                    feedback.append((user_id, order_id, rng.randint(1, 5), ""))
+
+        c.executemany("INSERT INTO orders (order_id, user_id, customer_name, mobile, order_date, total_amount, status, payment_method, qr_code) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", orders)
+        c.executemany("INSERT INTO order_items (order_id, item_name, price, quantity) VALUES (?, ?, ?, ?)", items)
+        c.executemany("INSERT INTO feedback (user_id, order_id, rating, comment) VALUES (?, ?, ?, ?)", feedback)
+
+    db.rebuild_sales_rollups()
+    return {'menu': menu, 'user_ids': user_ids, 'orders': len(orders), 'order_items': len(items),
+            'feedback': len(feedback)}
+
+# ---------------- WORKLOAD ----------------
+def run_operation(name, seeded, rng, placed):
+    if name == "get_menu_items":
+        db.get_menu_items()
+    elif name == "get_orders":
+        db.get_orders(rng.choice(seeded['user_ids']), "student")
+    elif name == "get_orders.kitchen":
+        db.get_orders(role="staff", statuses=db.ACTIVE_ORDER_STATUSES)
+    elif name == "place_order":
+        lines = [(rng.choice(seeded['menu']), rng.randint(1, 3)) for _ in range(rng.randint(1, 4))]
+        cart = [{'id': item[0], 'name': item[1], 'price': item[2], 'qty': qty} for item, qty in lines]
+        total = sum(line['price'] * line['qty'] for line in cart)
+        result = db.place_order(rng.choice(seeded['user_ids']), "Bench", "0000000000", cart, total, "Cash", "CASH")
+        if result['ok']:
+            placed.append(result['order_id'])
+    elif name == "update_order_status":
+        if placed:
+            db.update_order_status(rng.choice(placed), rng.choice(["Preparing", "Ready", "Completed"]))
+    elif name == "has_feedback":
+        db.has_feedback(rng.randint(1, seeded['orders']))
+    elif name == "search_menu":
+        # A student typing the first letters of an item name
+        word = rng.choice(ITEM_NAMES).split()[0]
+        db.search_menu(word[:rng.randint(2, len(word))])
+    elif name == "get_pending_feedback_order":
+        db.get_pending_feedback_order(rng.choice(seeded['user_ids']))
+
+def worker(seeded, seed, deadline, results, placed):
+    rng = random.Random(seed)
+    names = [name for name, _ in WORKLOAD]
+    weights = [weight for _, weight in WORKLOAD]
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        stats = results.setdefault(name, {'latencies': [], 'errors': 0, 'lock_errors': 0})
+        start = time.perf_counter()
+        try:
+            run_operation(name, seeded, rng, placed)
+        except sqlite3.OperationalError as e:
+            stats['errors'] += 1
+            if "locked" in str(e) or "busy" in str(e):
+                stats['lock_errors'] += 1
+            continue
+        except Exception:
+            stats['errors'] += 1
+            continue
+        stats['latencies'].append(time.perf_counter() - start)
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run_benchmark(seeded, threads, duration, seed):
+    per_thread = [{} for _ in range(threads)]
+    placed = []
+    deadline = time.perf_counter() + duration
+    workers = [threading.Thread(target=worker, args=(seeded, seed + i, deadline, per_thread[i], placed))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    functions = {}
+    for name, _ in WORKLOAD:
+        latencies = sorted(l for r in per_thread for l in r.get(name, {}).get('latencies', []))
+        errors = sum(r.get(name, {}).get('errors', 0) for r in per_thread)
+        lock_errors = sum(r.get(name, {}).get('lock_errors', 0) for r in per_thread)
+        functions[name] = {
+            'calls': len(latencies),
+            'errors': errors,
+            'lock_errors': lock_errors,
+            'throughput_per_s': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3)
+        }
+    total_calls = sum(f['calls'] for f in functions.values())
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'total_calls': total_calls,
+        'throughput_per_s': round(total_calls / elapsed, 1),
+        'errors': sum(f['errors'] for f in functions.values()),
+        'lock_errors': sum(f['lock_errors'] for f in functions.values()),
+        'functions': functions
+    }
+
+# ---------------- ORDER ID ALLOCATION ----------------
+# Several processes (web app + CLI counters) allocate from the same database;
+# each process here allocates from several threads and all ids must be unique.
+def _allocate_ids(path, threads, count, block_size):
+    db.close_connections()
+    db.DB_PATH = path
+    ids = [[] for _ in range(threads)]
+    def run(out):
+        for _ in range(count // threads):
+            out.append(db.allocate_order_id(block_size))
+    workers = [threading.Thread(target=run, args=(ids[i],)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    db.close_connections()
+    return [i for out in ids for i in out], elapsed
+
+def run_id_benchmark(path, processes, threads, count, block_size):
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        start = time.perf_counter()
+        results = pool.starmap(_allocate_ids, [(path, threads, count, block_size)] * processes)
+        elapsed = time.perf_counter() - start
+    ids = [i for process_ids, _ in results for i in process_ids]
+    return {
+        'processes': processes,
+        'threads_per_process': threads,
+        'block_size': block_size,
+        'ids': len(ids),
+        'duplicates': len(ids) - len(set(ids)),
+        # Per process, excluding process start-up
+        'ids_per_s': [round(len(process_ids) / t, 1) for process_ids, t in results],
+        'total_ids_per_s': round(len(ids) / elapsed, 1)
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=db.BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ---------------- MAIN ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Lunch-rush benchmark for database.py")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "canteen_bench.db"),
+                        help="benchmark database path (recreated on every run)")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--menu-items", type=int, default=60)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--orders-per-day", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=40)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of replayed load")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--group-commit", action="store_true", help="run with the group-commit writer")
+    parser.add_argument("--stock-ledger", action="store_true", help="run with the in-memory stock ledger")
+    parser.add_argument("--id-processes", type=int, default=4, help="processes allocating order ids")
+    parser.add_argument("--ids-per-process", type=int, default=100000)
+    parser.add_argument("--id-block-size", type=int, default=db.ORDER_ID_BLOCK_SIZE)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.db) == os.path.abspath(db.DB_PATH):
+        parser.error("refusing to overwrite the live canteen.db")
+
+    rng = random.Random(args.seed)
+    seed_start = time.perf_counter()
+    seeded = seed_database(args.db, args.users, args.menu_items, args.months, args.orders_per_day, rng)
+    seed_time = time.perf_counter() - seed_start
+
+    if args.group_commit:
+        db.start_group_commit()
+    if args.stock_ledger:
+        db.start_stock_ledger()
+    report = run_benchmark(seeded, args.threads, args.duration, args.seed)
+    db.close_connections()
+    id_report = run_id_benchmark(args.db, args.id_processes, 4, args.ids_per_process, args.id_block_size)
+
+    report = {
+        'commit': git_commit(),
+        'config': {k: v for k, v in vars(args).items() if k != "output"},
+        'seeded': {k: seeded[k] for k in ("orders", "order_items", "feedback")},
+        'seed_s': round(seed_time, 3),
+        **report,
+        'order_id_allocation': id_report
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,132 @@
 # ========= SMART CANTEEN MANAGEMENT SYSTEM (FINAL + ROBUST PAYMENT) =========
 
-import sqlite3
 import datetime
-import random
+import json
+import logging
 import os
-
-# ---------------- DB PATH ----------------
+import socket
+import sqlite3
+import sys
+import threading
+import uuid
+
+import database as db
+
+# ---------------- POS JOURNAL ----------------
+# Bills are appended to a local journal and returned immediately; a background
+# thread (and option 8) bulk-loads them into the shared canteen.db through
+# database.import_pos_bills. The offset file remembers how far the journal has
+# been synced; re-syncing a bill is harmless because bill_id is unique. Lines
+# that are not valid JSON are moved to the .rejected file for a person to look
+# at, so one damaged line cannot hold up every bill behind it.
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "canteen.db")
-
-conn = sqlite3.connect(DB_PATH)
-cur = conn.cursor()
-
-# ---------------- DB INIT ----------------
-def init_db():
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS menu(
-        id INTEGER PRIMARY KEY,
-        name TEXT,
-        price INTEGER
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS orders(
-        order_id INTEGER PRIMARY KEY,
-        customer TEXT,
-        mobile TEXT,
-        date TEXT,
-        subtotal REAL,
-        discount REAL,
-        gst REAL,
-        parcel REAL,
-        grand REAL,
-        payment TEXT
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS order_items(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER,
-        item_name TEXT,
-        price INTEGER,
-        quantity INTEGER
-    )
-    """)
-
-    cur.execute("SELECT COUNT(*) FROM menu")
-    if cur.fetchone()[0] == 0:
-        items = [
-            (1, "Burger", 50),
-            (2, "Pizza", 120),
-            (3, "Sandwich", 40),
-            (4, "Cold Drink", 30),
-            (5, "Coffee", 25)
-        ]
-        cur.executemany("INSERT INTO menu VALUES (?,?,?)", items)
-
-    conn.commit()
+JOURNAL_PATH = os.environ.get("CANTEEN_POS_JOURNAL", os.path.join(BASE_DIR, "pos_journal.jsonl"))
+OFFSET_PATH = JOURNAL_PATH + ".offset"
+REJECTED_PATH = JOURNAL_PATH + ".rejected"
+TERMINAL_ID = os.environ.get("CANTEEN_TERMINAL", socket.gethostname())
+SYNC_BATCH_SIZE = 200
+ORDER_ID_BLOCK_SIZE = 500 # Ids reserved per trip to the shared DB
+SYNC_INTERVAL_SECONDS = 30
+
+logger = logging.getLogger("canteen.pos")
+_journal_lock = threading.Lock()
+_sync_lock = threading.Lock()
+_stop_sync = threading.Event()
+
+def append_to_journal(bill):
+    line = json.dumps(bill, separators=(",", ":")) + "\n"
+    with _journal_lock:
+        with open(JOURNAL_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+def _read_offset():
+    try:
+        with open(OFFSET_PATH) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def _write_offset(offset):
+    tmp = OFFSET_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(str(offset))
+    os.replace(tmp, OFFSET_PATH)
+
+def pending_bills(rejected=None):
+    # Complete journal lines not yet synced, as (end_offset, bill) pairs. Lines
+    # that do not parse are skipped, and collected as (end_offset, raw) in rejected.
+    offset = _read_offset()
+    try:
+        with open(JOURNAL_PATH, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except OSError:
+        return []
+    bills = []
+    for raw in data.splitlines(keepends=True):
+        if not raw.endswith(b"\n"):
+            break # Partially written last line; pick it up next time
+        offset += len(raw)
+        if not raw.strip():
+            continue
+        try:
+            bills.append((offset, json.loads(raw)))
+        except ValueError:
+            if rejected is not None:
+                rejected.append((offset, raw))
+    return bills
+
+def _advance_offset(offset, rejected):
+    # Unreadable lines the new offset moves past are set aside first, so none is lost
+    passed = [raw for end, raw in rejected if end <= offset]
+    if passed:
+        with open(REJECTED_PATH, "ab") as f:
+            f.writelines(passed)
+            f.flush()
+            os.fsync(f.fileno())
+        logger.warning("Moved %d unreadable journal line(s) to %s", len(passed), REJECTED_PATH)
+        del rejected[:len(passed)]
+    _write_offset(offset)
+
+def sync_journal():
+    # Returns (imported, skipped); one database transaction per batch
+    with _sync_lock:
+        rejected = []
+        pending = pending_bills(rejected)
+        imported = skipped = 0
+        for start in range(0, len(pending), SYNC_BATCH_SIZE):
+            batch = pending[start:start + SYNC_BATCH_SIZE]
+            done, dup = db.import_pos_bills([bill for _, bill in batch])
+            _advance_offset(batch[-1][0], rejected)
+            imported += done
+            skipped += dup
+        if rejected:
+            _advance_offset(rejected[-1][0], rejected)
+        return imported, skipped
+
+def _prefetch_order_ids():
+    # Billing takes ids from memory only; this keeps the next block reserved
+    try:
+        db.prefetch_order_id_block(ORDER_ID_BLOCK_SIZE)
+    except sqlite3.Error as e:
+        logger.warning("Could not reserve order ids, new bills get theirs when synced: %s", e)
+
+def _sync_loop():
+    _prefetch_order_ids()
+    while not _stop_sync.wait(SYNC_INTERVAL_SECONDS):
+        try:
+            sync_journal()
+        except sqlite3.Error as e:
+            # Shared DB unavailable; bills stay in the journal for the next attempt
+            logger.warning("POS sync failed, bills kept in the journal: %s", e)
+        except Exception:
+            logger.exception("POS sync failed, bills kept in the journal")
+        _prefetch_order_ids()
+
+def start_background_sync():
+    threading.Thread(target=_sync_loop, name="pos-sync", daemon=True).start()
 
 # ---------------- GLOBALS ----------------
 cart = []
@@ -68,9 +136,8 @@ last_bill = None
 def display_menu():
     print("\n------ CANTEEN MENU ------")
     print("ID\tItem\t\tPrice")
-    cur.execute("SELECT * FROM menu")
-    for r in cur.fetchall():
-        print(r[0], "\t", r[1].ljust(12), r[2])
+    for r in db.get_menu_items():
+        print(r.id, "\t", r.name.ljust(12), r.price)
 
 # ---------------- CART ----------------
 def show_cart():
@@ -81,9 +148,9 @@ def show_cart():
     subtotal = 0
     print("\nItem\t\tPrice Qty Total")
     for i in cart:
-        t = i[1] * i[2]
+        t = i['price'] * i['qty']
         subtotal += t
-        print(i[0].ljust(12), i[1], i[2], t)
+        print(i['name'].ljust(12), i['price'], i['qty'], t)
     print("Subtotal:", subtotal)
     gst = subtotal * 0.05
     print("GST (5%):", gst)
@@ -92,8 +159,7 @@ def add_multiple_items():
     while True:
         try:
             item_id = int(input("Enter item ID: "))
-            cur.execute("SELECT name, price FROM menu WHERE id=?", (item_id,))
-            item = cur.fetchone()
+            item = next((r for r in db.get_menu_items() if r.id == item_id), None)
 
             if not item:
                 print("❌ Invalid item ID")
@@ -104,7 +170,7 @@ def add_multiple_items():
                 print("❌ Invalid quantity")
                 continue
 
-            cart.append([item[0], item[1], qty])
+            cart.append({'id': item.id, 'name': item.name, 'price': item.price, 'qty': qty})
             print("✅ Item added")
 
         except:
@@ -123,11 +189,11 @@ def remove_item_quantity():
     qty = int(input("Qty to remove: "))
 
     for item in cart:
-        if item[0].lower() == name:
-            if qty >= item[2]:
+        if item['name'].lower() == name:
+            if qty >= item['qty']:
                 cart.remove(item)
             else:
-                item[2] -= qty
+                item['qty'] -= qty
             print("✅ Cart updated")
             return
 
@@ -215,44 +281,50 @@ def generate_bill():
         except ValueError as e:
             print(f"❌ {e}")
 
-    order_id = random.randint(1000, 9999)
-    date = datetime.datetime.now().strftime("%d-%m-%Y %H:%M")
+    # Never waits on the shared DB: without a reserved id left, the bill is
+    # journaled without one and import_pos_bills assigns it when synced
+    order_id = db.allocate_order_id(reserve=False)
+    bill_id = uuid.uuid4().hex[:12]
+    date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    subtotal = sum(i[1] * i[2] for i in cart)
+    subtotal = sum(i['price'] * i['qty'] for i in cart)
     discount = subtotal * 0.10 if subtotal >= 499 else 0
     parcel = 20 if input("Food Parcel? (yes/no): ").lower() == "yes" else 0
     gst = subtotal * 0.05
     grand = subtotal + gst + parcel - discount
 
-    payment, change = payment_method(grand, order_id)
+    payment, change = payment_method(grand, order_id or bill_id)
 
     if payment is None:
         print("❌ Bill generation aborted")
         return
 
-    # SAVE ORDER
-    cur.execute("""
-    INSERT INTO orders VALUES (?,?,?,?,?,?,?,?,?,?)
-    """, (order_id, name, mobile, date, subtotal, discount, gst, parcel, grand, payment))
-
-    # SAVE ITEMS
-    for i in cart:
-        cur.execute("""
-        INSERT INTO order_items(order_id,item_name,price,quantity)
-        VALUES (?,?,?,?)
-        """, (order_id, i[0], i[1], i[2]))
-
-    conn.commit()
+    # SAVE BILL (local journal only; synced to canteen.db in the background)
+    append_to_journal({
+        "bill_id": bill_id,
+        "order_id": order_id,
+        "terminal": TERMINAL_ID,
+        "order_date": date,
+        "customer_name": name,
+        "mobile": mobile,
+        "items": cart,
+        "subtotal": subtotal,
+        "discount": discount,
+        "gst": gst,
+        "parcel": parcel,
+        "grand": grand,
+        "payment": payment
+    })
 
     last_bill = {
-        "order_id": order_id,
+        "order_id": order_id or bill_id,
         "grand": grand,
         "payment": payment,
         "change": change
     }
 
     print("\n========= FINAL BILL =========")
-    print("Order ID     :", order_id)
+    print("Order ID     :", order_id or f"{bill_id} (order id assigned when synced)")
     print("GST (5%)     :", gst)
     print("Grand Total  :", grand)
     print("Payment Mode :", payment)
@@ -264,35 +336,47 @@ def generate_bill():
 
 # ---------------- REVENUE ----------------
 def show_revenue():
-    cur.execute("SELECT SUM(grand) FROM orders")
-    r = cur.fetchone()[0]
-    print("\n Total Revenue:", r if r else 0)
+    stats = db.get_revenue_stats()
+    print("\n Total Revenue:", stats['total_revenue'])
+    pending = pending_bills()
+    if pending:
+        print(f" (+ {sum(bill['grand'] for _, bill in pending)} in {len(pending)} bills not synced yet)")
 
 # ---------------- HISTORY ----------------
 def search_order_history():
     print("\n------ ORDER HISTORY SEARCH ------")
     mobile = input("Enter Customer Mobile Number: ")
 
-    cur.execute("SELECT * FROM orders WHERE mobile=?", (mobile,))
-    orders = cur.fetchall()
+    orders = db.get_orders(role="admin", mobile=mobile, source="all")
+    unsynced = [bill for _, bill in pending_bills() if bill['mobile'] == mobile]
 
-    if not orders:
+    if not orders and not unsynced:
         print("❌ No orders found for this mobile number.")
         return
 
     print(f"\nOrders for Mobile: {mobile}")
     print("Order ID\tDate\t\tAmount")
     for o in orders:
-        # o[0] is order_id, o[3] is date, o[8] is grand
-        print(f"{o[0]}\t\t{o[3]}\t{o[8]}")
+        print(f"{o.order_id}\t\t{o.order_date}\t{o.total_amount}")
+    for bill in unsynced:
+        print(f"{bill.get('order_id') or bill['bill_id']}\t\t{bill['order_date']}\t{bill['grand']} (not synced yet)")
+
+# ---------------- SYNC ----------------
+def sync_now():
+    try:
+        imported, skipped = sync_journal()
+        print(f"✅ Synced {imported} bills ({skipped} already synced)")
+    except Exception as e:
+        print(f"❌ Sync failed, bills kept in journal: {e}")
 
 # ---------------- MAIN ----------------
 def main():
-    init_db()
+    db.init_db()
+    start_background_sync()
 
     while True:
         print("\n1.Menu\n2.Add Items\n3.Remove Item\n4.Show Cart")
-        print("5.Generate Bill\n6.Show Revenue\n7.Search Order History\n8.Exit")
+        print("5.Generate Bill\n6.Show Revenue\n7.Search Order History\n8.Sync Bills\n9.Exit")
 
         ch = input("Choice: ")
 
@@ -312,9 +396,19 @@ def main():
         elif ch == "7":
             search_order_history()
         elif ch == "8":
+            sync_now()
+        elif ch == "9":
+            _stop_sync.set()
+            sync_now()
             print("Thank you! 😊")
             break
         else:
             print("❌ Invalid choice")
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    if "--sync" in sys.argv[1:]:
+        # Sync the journal and exit (e.g. from cron when the counter is closed)
+        db.init_db()
+        sync_now()
+    else:
+        main()
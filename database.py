@@ -1,19 +1,510 @@
 import sqlite3
+import csv
 import hashlib
+import io
 import os
 import datetime
+import functools
+import json
+import logging
+import queue
+import re
+import tempfile
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager
 
 # Database Path
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "canteen.db")
+# Cold storage for old finished orders, attached to every connection as "archive".
+# None means next to DB_PATH (canteen.db -> canteen_archive.db).
+ARCHIVE_PATH = os.environ.get("CANTEEN_ARCHIVE_DB")
+
+ORDER_STATUSES = ["Received", "Preparing", "Ready", "Completed", "Cancelled"]
+ACTIVE_ORDER_STATUSES = ["Received", "Preparing", "Ready"]
+
+# Menu items without their own prep settings (see _migration_010_kitchen_prep)
+DEFAULT_PREP_SECONDS = 180
+DEFAULT_STATION = "General"
+
+# --- RECORDS ---
+# Read functions return these instead of SELECT * tuples. Columns are selected
+# by name, so a migration that reorders or adds columns cannot shift fields,
+# and bulky columns nobody reads back (the orders.qr_code payload, order_items.id)
+# never leave the database.
+MenuItem = namedtuple("MenuItem", ["id", "name", "price", "stock", "category", "description", "image_url",
+                                   "prep_seconds", "station", "batch_size"])
+Order = namedtuple("Order", ["order_id", "user_id", "customer_name", "mobile", "order_date", "total_amount",
+                             "status", "payment_method"])
+OrderItem = namedtuple("OrderItem", ["order_id", "item_name", "price", "quantity"])
+Feedback = namedtuple("Feedback", ["id", "username", "order_id", "rating", "comment", "created_at"])
+RatingSummary = namedtuple("RatingSummary", ["key", "count", "mean", "distribution"]) # distribution: counts of 1..5
+
+def _columns(record, alias=None):
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(prefix + field for field in record._fields)
+
+# --- CONNECTION SETTINGS ---
+READ_POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 8192
+MAX_SQL_PARAMS = 500 # Stay well below SQLite's host parameter limit
+
+# Readers are pooled and reused across calls (and Streamlit session threads).
+# All writes go through a single connection serialized by _write_lock, so with
+# WAL enabled the kitchen display keeps reading while an order is committing.
+_read_pool = queue.LifoQueue(maxsize=READ_POOL_SIZE)
+_writer = None
+_write_lock = threading.RLock()
+
+# --- INSTRUMENTATION ---
+# Every public function below is wrapped in @instrumented (calls, latency
+# percentiles, rows returned). Each connection gets a trace callback that times
+# the SQL statements run inside those calls and a progress handler that counts
+# SQLite VM steps. Statements slower than SLOW_QUERY_MS are logged together
+# with their EXPLAIN QUERY PLAN. CANTEEN_INSTRUMENTATION=0 turns it all off.
+INSTRUMENTATION = os.environ.get("CANTEEN_INSTRUMENTATION", "1") == "1"
+SLOW_QUERY_MS = float(os.environ.get("CANTEEN_SLOW_QUERY_MS", "50"))
+LATENCY_SAMPLES = 2048
+SLOW_QUERY_LOG_SIZE = 200
+PROGRESS_STEP = 1000
+
+logger = logging.getLogger("canteen.db")
+
+_stats_lock = threading.Lock()
+_function_stats = {}
+_statement_stats = {}
+_slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_connections_opened = 0
+_call_context = threading.local()
+_call_listeners = [] # fn(function_name, elapsed_ms), called after each top-level call
+
+def add_call_listener(listener):
+    # Lets callers outside this module (e.g. the rerun profiler) attribute time to the database
+    if listener not in _call_listeners:
+        _call_listeners.append(listener)
+
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_IN_LISTS = re.compile(r"IN \((?:\?\s*,\s*)*\?\)", re.IGNORECASE)
+
+def _normalize_sql(sql):
+    # Group statements that differ only in their bound values
+    sql = _SQL_IN_LISTS.sub("IN (...)", _SQL_LITERALS.sub("?", sql))
+    return " ".join(sql.split())
+
+def _finish_statement(ctx, now):
+    sql, started, function = ctx.statement
+    ctx.statement = None
+    elapsed_ms = (now - started) * 1000
+    key = _normalize_sql(sql)
+    with _stats_lock:
+        # The first run is kept as an example with real values, for explain_queries
+        stats = _statement_stats.setdefault(key, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                                  'function': function, 'example': sql})
+        stats['count'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+    if elapsed_ms >= SLOW_QUERY_MS:
+        ctx.slow.append((sql, elapsed_ms))
+
+def _trace_statement(sql):
+    # Called by sqlite3 with the expanded SQL just before each statement runs;
+    # a statement lasts until the next one starts or its function returns.
+    ctx = _call_context
+    if not getattr(ctx, 'depth', 0) or getattr(ctx, 'explaining', False):
+        return
+    now = time.perf_counter()
+    if ctx.statement is not None:
+        _finish_statement(ctx, now)
+    ctx.statement = (sql, now, getattr(ctx, 'function', None))
+
+def _count_vm_steps():
+    ctx = _call_context
+    if getattr(ctx, 'depth', 0):
+        ctx.vm_steps += PROGRESS_STEP
+    return 0
+
+def _count_rows(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict) and result and all(isinstance(v, list) for v in result.values()):
+        return sum(len(v) for v in result.values())
+    if isinstance(result, tuple):
+        return 1
+    return 0
+
+def _log_slow_queries(function_name, slow):
+    ctx = _call_context
+    ctx.explaining = True
+    try:
+        for sql, elapsed_ms in slow:
+            plan = []
+            if sql.lstrip().split(None, 1)[0].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+                try:
+                    with read_connection() as conn:
+                        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+                except sqlite3.Error:
+                    pass
+            entry = {
+                'at': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'function': function_name,
+                'ms': round(elapsed_ms, 3),
+                'sql': sql[:2000],
+                'plan': plan
+            }
+            with _stats_lock:
+                _slow_queries.append(entry)
+            logger.warning("Slow query in %s (%.1f ms): %s | plan: %s", function_name, elapsed_ms, entry['sql'],
+                           "; ".join(plan) or "n/a")
+    finally:
+        ctx.explaining = False
+
+_instrumented_functions = [] # Names of every @instrumented function, for the query plan check
+
+def instrumented(fn):
+    name = fn.__name__
+    _instrumented_functions.append(name)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not INSTRUMENTATION:
+            if not _call_listeners:
+                return fn(*args, **kwargs)
+            # Like the instrumented path, only the outermost call is reported
+            ctx = _call_context
+            outer = not getattr(ctx, 'depth', 0)
+            ctx.depth = getattr(ctx, 'depth', 0) + 1
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                ctx.depth -= 1
+                if outer:
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                    for listener in _call_listeners:
+                        listener(name, elapsed_ms)
+        ctx = _call_context
+        outer = not getattr(ctx, 'depth', 0)
+        if outer:
+            ctx.statement, ctx.slow, ctx.vm_steps = None, [], 0
+        ctx.depth = getattr(ctx, 'depth', 0) + 1
+        caller, ctx.function = getattr(ctx, 'function', None), name
+        failed = False
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+            return result
+        except Exception:
+            failed = True
+            result = None
+            raise
+        finally:
+            end = time.perf_counter()
+            ctx.depth -= 1
+            ctx.function = caller
+            if outer:
+                if ctx.statement is not None:
+                    _finish_statement(ctx, end)
+                vm_steps, slow = ctx.vm_steps, ctx.slow
+            with _stats_lock:
+                stats = _function_stats.setdefault(name, {
+                    'calls': 0, 'errors': 0, 'total_ms': 0.0, 'rows': 0, 'vm_steps': 0,
+                    'samples': deque(maxlen=LATENCY_SAMPLES)
+                })
+                elapsed_ms = (end - start) * 1000
+                stats['calls'] += 1
+                stats['errors'] += failed
+                stats['total_ms'] += elapsed_ms
+                stats['rows'] += _count_rows(result)
+                stats['samples'].append(elapsed_ms)
+                if outer:
+                    stats['vm_steps'] += vm_steps
+            if outer and slow:
+                _log_slow_queries(name, slow)
+            if outer:
+                for listener in _call_listeners:
+                    listener(name, elapsed_ms)
+    return wrapper
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+def get_query_stats():
+    with _stats_lock:
+        functions = {}
+        for name, stats in _function_stats.items():
+            samples = sorted(stats['samples'])
+            functions[name] = {
+                'calls': stats['calls'],
+                'errors': stats['errors'],
+                'total_ms': round(stats['total_ms'], 3),
+                'avg_ms': round(stats['total_ms'] / stats['calls'], 3) if stats['calls'] else 0.0,
+                'p50_ms': round(_percentile(samples, 50), 3),
+                'p95_ms': round(_percentile(samples, 95), 3),
+                'p99_ms': round(_percentile(samples, 99), 3),
+                'rows': stats['rows'],
+                'vm_steps': stats['vm_steps']
+            }
+        statements = {
+            sql: dict(stats, total_ms=round(stats['total_ms'], 3), max_ms=round(stats['max_ms'], 3))
+            for sql, stats in _statement_stats.items()
+        }
+        return {
+            'connections_opened': _connections_opened,
+            'slow_query_ms': SLOW_QUERY_MS,
+            'functions': functions,
+            'statements': statements,
+            'slow_queries': list(_slow_queries)
+        }
+
+def reset_query_stats():
+    global _connections_opened
+    with _stats_lock:
+        _function_stats.clear()
+        _statement_stats.clear()
+        _slow_queries.clear()
+        _connections_opened = 0
+
+def dump_query_stats(path):
+    with open(path, "w") as f:
+        json.dump(get_query_stats(), f, indent=2)
 
 def get_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    global _connections_opened
+    # isolation_level=None: no implicit transactions, writers use explicit BEGIN
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    with _stats_lock:
+        _connections_opened += 1
+    if INSTRUMENTATION:
+        conn.set_trace_callback(_trace_statement)
+        conn.set_progress_handler(_count_vm_steps, PROGRESS_STEP)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path(),))
+    return conn
+
+def archive_path():
+    return ARCHIVE_PATH or os.path.splitext(DB_PATH)[0] + "_archive.db"
+
+@contextmanager
+def read_connection():
+    try:
+        conn = _read_pool.get_nowait()
+    except queue.Empty:
+        conn = get_connection()
+        conn.execute("PRAGMA query_only = ON")
+    try:
+        yield conn
+    finally:
+        try:
+            _read_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        _writer = get_connection()
+        # WAL is persistent in the database file; set it once from the writer
+        _writer.execute("PRAGMA journal_mode = WAL")
+    return _writer
+
+@contextmanager
+def write_transaction(mode="IMMEDIATE"):
+    with _write_lock:
+        conn = _get_writer()
+        conn.execute(f"BEGIN {mode}")
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        else:
+            try:
+                conn.execute("COMMIT")
+            except BaseException:
+                # A failed COMMIT (busy, disk full, I/O error, deferred constraint)
+                # can leave the transaction open, and then every later BEGIN on
+                # the shared writer fails. Roll it back so the writer stays usable.
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+
+def close_connections():
+    global _writer
+    stop_stock_ledger()
+    stop_group_commit()
+    with _order_id_lock:
+        _order_id_block[:] = [0, 0] # Reserved for the old database
+        _order_id_spare.clear()
+    _drop_menu_cache() # Its menu_version belongs to the old database too
+    with _write_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+    while True:
+        try:
+            _read_pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+# --- GROUP COMMIT ---
+# Optional single-writer mode (CANTEEN_GROUP_COMMIT=1 or start_group_commit()).
+# Callers enqueue their write and wait on a Future; one background thread drains
+# the queue and commits up to GROUP_COMMIT_MAX_BATCH writes per transaction, so
+# concurrent checkouts queue briefly instead of fighting over the database lock.
+# Each write runs in its own SAVEPOINT, so one failing write does not undo the rest.
+GROUP_COMMIT = os.environ.get("CANTEEN_GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_MAX_BATCH = 64
+
+_write_queue = queue.Queue() # Queue of the running writer; each writer thread gets its own
+_group_commit_thread = None
+_group_commit_lock = threading.Lock()
+_group_commit_stats = {'batches': 0, 'writes': 0, 'failed': 0, 'last_batch_size': 0, 'max_batch_size': 0}
+
+def start_group_commit():
+    global _group_commit_thread, _write_queue
+    with _group_commit_lock:
+        if _group_commit_thread is None:
+            _write_queue = queue.Queue()
+            _group_commit_thread = threading.Thread(target=_group_commit_loop, args=(_write_queue,),
+                                                    name="canteen-group-commit", daemon=True)
+            _group_commit_thread.start()
 
+def stop_group_commit():
+    # Writes already queued are committed before the thread exits. The sentinel
+    # is queued under the same lock _run_write enqueues under, so no write can
+    # land behind it; later writes run directly (or on a new writer).
+    global _group_commit_thread
+    with _group_commit_lock:
+        thread = _group_commit_thread
+        if thread is None:
+            return
+        _group_commit_thread = None
+        _write_queue.put(None)
+    # Join outside the lock: _commit_batch takes it to update the stats
+    thread.join()
+
+def get_write_queue_stats():
+    with _group_commit_lock:
+        stats = dict(_group_commit_stats)
+        stats['running'] = _group_commit_thread is not None
+    stats['queue_depth'] = _write_queue.qsize()
+    stats['avg_batch_size'] = stats['writes'] / stats['batches'] if stats['batches'] else 0.0
+    return stats
+
+def _group_commit_loop(commands):
+    try:
+        while True:
+            first = commands.get()
+            if first is None:
+                return
+            batch = [first]
+            stopping = False
+            while len(batch) < GROUP_COMMIT_MAX_BATCH:
+                try:
+                    command = commands.get_nowait()
+                except queue.Empty:
+                    break
+                if command is None:
+                    stopping = True
+                    break
+                batch.append(command)
+            _commit_batch(batch)
+            if stopping:
+                return
+    finally:
+        # Nothing should follow the sentinel, but never leave a caller waiting forever
+        while True:
+            try:
+                command = commands.get_nowait()
+            except queue.Empty:
+                break
+            if command is not None:
+                command[2].set_exception(RuntimeError("group commit writer stopped"))
+
+def _commit_batch(batch):
+    outcomes = []
+    try:
+        with write_transaction() as conn:
+            c = conn.cursor()
+            for fn, args, future in batch:
+                c.execute("SAVEPOINT group_write")
+                try:
+                    outcomes.append((future, fn(c, *args), None))
+                except Exception as e:
+                    c.execute("ROLLBACK TO group_write")
+                    outcomes.append((future, None, e))
+                c.execute("RELEASE group_write")
+    except Exception as e:
+        # The COMMIT itself failed and write_transaction rolled it back: nothing in this batch was written
+        outcomes = [(future, None, e) for _, _, future in batch]
+
+    with _group_commit_lock:
+        _group_commit_stats['batches'] += 1
+        _group_commit_stats['writes'] += len(batch)
+        _group_commit_stats['failed'] += sum(1 for _, _, error in outcomes if error is not None)
+        _group_commit_stats['last_batch_size'] = len(batch)
+        _group_commit_stats['max_batch_size'] = max(_group_commit_stats['max_batch_size'], len(batch))
+    for future, result, error in outcomes:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+def _run_write(fn, *args):
+    # Runs fn(cursor, *args) in a write transaction and returns its result once committed
+    if GROUP_COMMIT and _group_commit_thread is None:
+        start_group_commit()
+    future = None
+    with _group_commit_lock:
+        if _group_commit_thread is not None and threading.current_thread() is not _group_commit_thread:
+            future = Future()
+            _write_queue.put((fn, args, future))
+    if future is not None:
+        return future.result()
+    with write_transaction() as conn:
+        return fn(conn.cursor(), *args)
+
+# --- SCHEMA MIGRATIONS ---
+# Each migration runs exactly once, in order, and bumps schema_version.
+# Add new schema changes as a new numbered function; never edit an applied one.
+
+@instrumented
 def init_db():
-    conn = get_connection()
-    c = conn.cursor()
+    if _schema_version() == LATEST_SCHEMA_VERSION:
+        _recover_pending_stock()
+        return
+    with write_transaction() as conn:
+        c = conn.cursor()
+        c.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        c.execute("SELECT MAX(version) FROM schema_version")
+        current = c.fetchone()[0] or 0
+        for version, migrate in MIGRATIONS:
+            if version > current:
+                migrate(c)
+                c.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+    _drop_menu_cache() # Migrations may reshape the menu without firing the triggers
+
+def _schema_version():
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'")
+        if not c.fetchone():
+            return 0
+        c.execute("SELECT MAX(version) FROM schema_version")
+        return c.fetchone()[0] or 0
 
+def _migration_001_base_schema(c):
+    # Also upgrades databases created before schema_version existed
     # --- USERS TABLE ---
     c.execute("""
     CREATE TABLE IF NOT EXISTS users (
@@ -130,156 +621,1567 @@ def init_db():
     """)
 
     # Create default admin if not exists
-    c.execute("SELECT * FROM users WHERE role='admin'")
+    c.execute("SELECT id FROM users WHERE role='admin'")
     if not c.fetchone():
         # Default Admin: admin / admin123
         pwd_hash = hashlib.sha256("admin123".encode()).hexdigest()
         c.execute("INSERT INTO users (username, password, role, name, mobile) VALUES (?, ?, ?, ?, ?)", 
                   ("admin", pwd_hash, "admin", "System Admin", "0000000000"))
 
-    conn.commit()
-    conn.close()
+def _migration_002_hot_query_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id, order_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_feedback_order ON feedback(order_id)")
+
+def _migration_003_status_keyset_index(c):
+    # Serves "status IN (...) ORDER BY order_id DESC LIMIT n" without a sort
+    c.execute("DROP INDEX IF EXISTS idx_orders_status")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders(status, order_id)")
+
+def _migration_004_sales_rollups(c):
+    # Rollup tables behind get_revenue_stats, backfilled from existing orders
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS daily_sales (
+        day TEXT PRIMARY KEY,
+        orders INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS daily_item_sales (
+        day TEXT NOT NULL,
+        item_name TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, item_name)
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS hourly_orders (
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour)
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS daily_payment_sales (
+        day TEXT NOT NULL,
+        payment_method TEXT NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, payment_method)
+    )
+    """)
+
+    _backfill_sales_rollups(c)
+
+def _backfill_sales_rollups(c, orders="orders", order_items="order_items"):
+    # orders/order_items may also be subqueries spanning the archive. Older
+    # databases allowed NULLs here: orders without a date have no day to count
+    # towards and are skipped, a missing payment method counts as 'Unknown'.
+    c.execute(f"""
+    INSERT INTO daily_sales (day, orders, revenue)
+    SELECT substr(order_date, 1, 10), COUNT(*), COALESCE(SUM(total_amount), 0) FROM {orders}
+    WHERE status != 'Cancelled' AND order_date IS NOT NULL GROUP BY 1
+    """)
+    c.execute(f"""
+    INSERT INTO hourly_orders (day, hour, orders)
+    SELECT substr(order_date, 1, 10), CAST(substr(order_date, 12, 2) AS INTEGER), COUNT(*) FROM {orders}
+    WHERE status != 'Cancelled' AND order_date IS NOT NULL GROUP BY 1, 2
+    """)
+    c.execute(f"""
+    INSERT INTO daily_payment_sales (day, payment_method, orders, revenue)
+    SELECT substr(order_date, 1, 10), COALESCE(payment_method, 'Unknown'), COUNT(*), COALESCE(SUM(total_amount), 0)
+    FROM {orders}
+    WHERE status != 'Cancelled' AND order_date IS NOT NULL GROUP BY 1, 2
+    """)
+    c.execute(f"""
+    INSERT INTO daily_item_sales (day, item_name, quantity, revenue)
+    SELECT substr(o.order_date, 1, 10), i.item_name, COALESCE(SUM(i.quantity), 0), COALESCE(SUM(i.price * i.quantity), 0)
+    FROM {order_items} i JOIN {orders} o ON o.order_id = i.order_id
+    WHERE o.status != 'Cancelled' AND o.order_date IS NOT NULL AND i.item_name IS NOT NULL GROUP BY 1, 2
+    """)
+
+def _migration_005_order_events(c):
+    # Append-only change feed; seq only ever grows (AUTOINCREMENT never reuses ids)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS order_events (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        event TEXT NOT NULL, -- 'placed', 'status'
+        status TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def _migration_006_pos_bills(c):
+    # Counter (CLI) bills synced from a terminal's journal; bill_id makes the sync idempotent
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS pos_bills (
+        bill_id TEXT PRIMARY KEY,
+        order_id INTEGER NOT NULL,
+        terminal TEXT,
+        subtotal REAL,
+        discount REAL,
+        gst REAL,
+        parcel REAL,
+        synced_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(order_id) REFERENCES orders(order_id)
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_mobile ON orders(mobile, order_id)")
+
+def _migration_007_id_sequences(c):
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS id_sequences (
+        name TEXT PRIMARY KEY,
+        next_value INTEGER NOT NULL
+    )
+    """)
+    c.execute("INSERT OR IGNORE INTO id_sequences (name, next_value) SELECT 'orders', COALESCE(MAX(order_id), 0) + 1 FROM orders")
+
+def _migration_008_menu_search(c):
+    # Full-text index over the menu, kept in sync by triggers. Stock updates
+    # (every order) do not touch indexed columns, so they skip the triggers.
+    try:
+        c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS menu_fts USING fts5(
+            name, description, category,
+            content='menu', content_rowid='id', prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+        )
+        """)
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: search_menu falls back to scanning the cached menu
+        logger.warning("Menu search index not created: %s", e)
+        return
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS menu_fts_insert AFTER INSERT ON menu BEGIN
+        INSERT INTO menu_fts (rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS menu_fts_delete AFTER DELETE ON menu BEGIN
+        INSERT INTO menu_fts (menu_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS menu_fts_update AFTER UPDATE OF name, description, category ON menu BEGIN
+        INSERT INTO menu_fts (menu_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO menu_fts (rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END
+    """)
+    c.execute("INSERT INTO menu_fts (menu_fts) VALUES ('rebuild')")
+
+def _migration_009_stock_pending(c):
+    # Stock decrements written by orders while the stock ledger is on, applied
+    # to menu.stock in batches (see STOCK LEDGER)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS stock_pending (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER,
+        item_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL
+    )
+    """)
+
+def _migration_010_kitchen_prep(c):
+    # Prep time, kitchen station and how many units one batch cooks at once
+    # (a fryer basket takes ten portions of fries), used by the prep scheduler
+    c.execute("PRAGMA table_info(menu)")
+    existing_cols = [row[1] for row in c.fetchall()]
+    for col, definition in {"prep_seconds": "INTEGER DEFAULT 180",
+                            "station": "TEXT DEFAULT 'General'",
+                            "batch_size": "INTEGER DEFAULT 1"}.items():
+        if col not in existing_cols:
+            c.execute(f"ALTER TABLE menu ADD COLUMN {col} {definition}")
+    # How many batches each station can work on at the same time
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS kitchen_stations (
+        name TEXT PRIMARY KEY,
+        slots INTEGER NOT NULL DEFAULT 1
+    )
+    """)
+    c.execute("INSERT OR IGNORE INTO kitchen_stations (name, slots) VALUES ('General', 2)")
+
+def _migration_011_feedback_rollups(c):
+    # Rating aggregates kept up to date by submit_feedback (see FEEDBACK). One row
+    # per scope/key: ('all', ''), ('item', item_name) and ('day', 'YYYY-MM-DD').
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS feedback_rollups (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        ratings INTEGER NOT NULL DEFAULT 0,
+        rating_sum INTEGER NOT NULL DEFAULT 0,
+        r1 INTEGER NOT NULL DEFAULT 0,
+        r2 INTEGER NOT NULL DEFAULT 0,
+        r3 INTEGER NOT NULL DEFAULT 0,
+        r4 INTEGER NOT NULL DEFAULT 0,
+        r5 INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (scope, key)
+    )
+    """)
+    # Feed filtered by rating, newest first
+    c.execute("CREATE INDEX IF NOT EXISTS idx_feedback_rating ON feedback(rating, id)")
+    _backfill_feedback_rollups(c)
+
+_FEEDBACK_ROLLUP_COLUMNS = "scope, key, ratings, rating_sum, r1, r2, r3, r4, r5"
+_FEEDBACK_COUNTS = "COUNT(*), SUM(rating), " + ", ".join(f"SUM(rating = {r})" for r in range(1, 6))
+
+def _backfill_feedback_rollups(c, order_items="order_items"):
+    # order_items may also be a subquery spanning the archive
+    counts, columns = _FEEDBACK_COUNTS, _FEEDBACK_ROLLUP_COLUMNS
+    c.execute(f"""
+    INSERT INTO feedback_rollups ({columns})
+    SELECT 'all', '', {counts} FROM feedback WHERE rating IS NOT NULL HAVING COUNT(*) > 0
+    """)
+    _backfill_feedback_days(c)
+    # An order's rating counts once for every distinct item on it
+    c.execute(f"""
+    INSERT INTO feedback_rollups ({columns})
+    SELECT 'item', i.item_name, {counts} FROM feedback f
+    JOIN (SELECT DISTINCT order_id, item_name FROM {order_items}) i ON i.order_id = f.order_id
+    WHERE rating IS NOT NULL GROUP BY 2
+    """)
+
+def _migration_012_menu_version(c):
+    # Bumped by triggers on every change to the menu, from any process, so each
+    # process can tell whether its cached menu is still current (see MENU FUNCTIONS)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS menu_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    """)
+    c.execute("INSERT OR IGNORE INTO menu_version (id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS menu_version_{event.lower()} AFTER {event} ON menu BEGIN
+            UPDATE menu_version SET version = version + 1 WHERE id = 1;
+        END
+        """)
+
+def _migration_013_order_events_index(c):
+    # When each active order went to "Preparing", looked up by the prep scheduler
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_events_order ON order_events(order_id, status)")
+
+def _backfill_feedback_days(c):
+    # created_at is UTC; days are local, like order_date and the admin date pickers
+    c.execute(f"""
+    INSERT INTO feedback_rollups ({_FEEDBACK_ROLLUP_COLUMNS})
+    SELECT 'day', date(created_at, 'localtime'), {_FEEDBACK_COUNTS} FROM feedback
+    WHERE rating IS NOT NULL GROUP BY 2
+    """)
+
+def _migration_014_feedback_local_days(c):
+    # Day rollups used to be keyed on the UTC date of created_at
+    c.execute("DELETE FROM feedback_rollups WHERE scope = 'day'")
+    _backfill_feedback_days(c)
+
+MIGRATIONS = [
+    (1, _migration_001_base_schema),
+    (2, _migration_002_hot_query_indexes),
+    (3, _migration_003_status_keyset_index),
+    (4, _migration_004_sales_rollups),
+    (5, _migration_005_order_events),
+    (6, _migration_006_pos_bills),
+    (7, _migration_007_id_sequences),
+    (8, _migration_008_menu_search),
+    (9, _migration_009_stock_pending),
+    (10, _migration_010_kitchen_prep),
+    (11, _migration_011_feedback_rollups),
+    (12, _migration_012_menu_version),
+    (13, _migration_013_order_events_index),
+    (14, _migration_014_feedback_local_days),
+]
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# --- QUERY PLAN CHECK ---
+# Plans are taken from the statements this process has actually run (recorded
+# by the instrumentation, with one real example each), so the check cannot
+# drift from the code. `python database.py --check` first runs
+# _exercise_queries on a scratch copy of the database so every query path has
+# run once; instrumented functions it did not call are listed, so a new one
+# that is missing from the workload shows up.
+_PLANNED_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+def explain_queries():
+    # {normalized sql: {'function', 'plan': [steps]}} for every data statement run so far
+    with _stats_lock:
+        statements = {sql: (stats['function'], stats['example']) for sql, stats in _statement_stats.items()
+                      if sql.split(" ", 1)[0].upper() in _PLANNED_STATEMENTS}
+    plans = {}
+    with read_connection() as conn:
+        c = conn.cursor()
+        for sql, (function, example) in sorted(statements.items(), key=lambda s: (s[1][0] or "", s[0])):
+            try:
+                c.execute(f"EXPLAIN QUERY PLAN {example}")
+                plan = [row[3] for row in c.fetchall()]
+            except sqlite3.Error as e:
+                plan = [f"not explained: {e}"]
+            plans[sql] = {'function': function, 'plan': plan}
+    return plans
+
+@instrumented
+def _exercise_queries():
+    # Calls every query path once. Only run against a scratch database: it writes.
+    # Being instrumented itself, it also records statements of the helpers it calls.
+    signup_user("plan_check", "plan_check", "student", "Plan Check", "9999999999")
+    user_id = login_user("plan_check", "plan_check")[0]
+    items = get_menu_items()
+    get_menu_version()
+    search_menu("veg")
+    search_menu("")
+    rows = export_menu()
+    import_menu(rows[:1])
+    import_menu([{'name': "Plan Check Item", 'price': 1, 'stock': 5}])
+    add_menu_item("Plan Check Extra", 1.0, 5, "General", "")
+    item = get_menu_items()[0]
+    update_stock(item.id, 1)
+    update_menu_stock_direct(item.id, 100)
+    set_kitchen_stations(get_kitchen_stations())
+    reserve_order_id_block(1)
+
+    cart = [{'id': item.id, 'name': item.name, 'price': item.price, 'qty': 1}]
+    order_id = place_order(user_id, "Plan Check", "9999999999", cart, item.price, "Cash", "")['order_id']
+    start_stock_ledger()
+    place_order(user_id, "Plan Check", "9999999999", cart, item.price, "Cash", "")
+    stop_stock_ledger()
+    import_pos_bills([{'bill_id': "plan-check", 'order_id': None, 'terminal': "check", 'order_date': "2000-01-01 12:00:00",
+                       'customer_name': "Plan Check", 'mobile': "9999999999", 'items': cart, 'subtotal': item.price,
+                       'discount': 0, 'gst': 0, 'parcel': 0, 'grand': item.price, 'payment': "Cash"}])
+
+    seq = get_latest_order_seq()
+    update_order_status(order_id, "Preparing")
+    get_preparing_since([order_id])
+    update_order_status(order_id, "Cancelled")
+    update_order_status(order_id, "Completed")
+    get_order_changes_since(seq)
+    get_order_changes_since(seq, user_id)
+    for source in ORDER_SOURCES:
+        get_orders(role="admin", source=source)
+        get_order_items(order_id, source)
+        get_order_items_bulk([order_id], source)
+    get_orders(user_id)
+    get_orders(role="admin", mobile="9999999999")
+    get_orders(role="staff", statuses=ACTIVE_ORDER_STATUSES)
+    get_orders(role="admin", statuses=["Completed"], before_id=order_id + 1, limit=25)
+    get_orders(role="admin", date_from="2000-01-01 00:00:00", date_to="2999-12-31 23:59:59", limit=25)
+
+    get_pending_feedback_order(user_id)
+    submit_feedback(user_id, order_id, 5, "")
+    has_feedback(order_id)
+    get_feedbacks(limit=25)
+    get_feedbacks(before_id=order_id, limit=25, ratings=[1, 2])
+    get_feedback_stats()
+    get_feedback_stats("2000-01-01", "2999-12-31")
+    get_revenue_stats()
+    get_revenue_stats("2000-01-01", "2999-12-31")
+    get_item_sales_by_day("2000-01-01")
+    get_item_sales_by_hour("2000-01-01")
+
+    archive_orders(0)
+    get_orders(role="admin", source="all")
+    get_archive_stats()
+    rebuild_sales_rollups()
+    return len(items)
+
+def check_queries():
+    # Runs _exercise_queries on a scratch copy of the database (and archive) and
+    # returns (plans, names of instrumented functions it did not call)
+    global DB_PATH, ARCHIVE_PATH, GROUP_COMMIT
+    if not INSTRUMENTATION:
+        raise RuntimeError("the query plan check needs CANTEEN_INSTRUMENTATION=1")
+    saved = DB_PATH, ARCHIVE_PATH, GROUP_COMMIT
+    close_connections()
+    with tempfile.TemporaryDirectory() as scratch:
+        copies = [(DB_PATH, os.path.join(scratch, "check.db")), (archive_path(), os.path.join(scratch, "check_archive.db"))]
+        for source, target in copies:
+            if os.path.exists(source):
+                with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+                    src.backup(dst)
+        try:
+            # Writes must run on this thread to be traced
+            DB_PATH, ARCHIVE_PATH, GROUP_COMMIT = copies[0][1], copies[1][1], False
+            reset_query_stats()
+            init_db()
+            _exercise_queries()
+            plans = explain_queries()
+            called = set(get_query_stats()['functions'])
+        finally:
+            close_connections()
+            DB_PATH, ARCHIVE_PATH, GROUP_COMMIT = saved
+    return plans, [name for name in _instrumented_functions if name not in called]
 
 # --- AUTH FUNCTIONS ---
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+def _signup_user_tx(c, username, password_hash, role, name, mobile):
+    c.execute("INSERT INTO users (username, password, role, name, mobile) VALUES (?, ?, ?, ?, ?)",
+              (username, password_hash, role, name, mobile))
+
+@instrumented
 def signup_user(username, password, role, name, mobile):
-    conn = get_connection()
-    c = conn.cursor()
     try:
-        c.execute("INSERT INTO users (username, password, role, name, mobile) VALUES (?, ?, ?, ?, ?)",
-                  (username, hash_password(password), role, name, mobile))
-        conn.commit()
+        _run_write(_signup_user_tx, username, hash_password(password), role, name, mobile)
         return True, "User registered successfully!"
     except sqlite3.IntegrityError:
         return False, "Username already exists."
-    finally:
-        conn.close()
 
+@instrumented
 def login_user(username, password):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, username, role, name FROM users WHERE username=? AND password=?", 
-              (username, hash_password(password)))
-    user = c.fetchone()
-    conn.close()
-    return user
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, username, role, name FROM users WHERE username=? AND password=?", 
+                  (username, hash_password(password)))
+        return c.fetchone()
 
 # --- MENU FUNCTIONS ---
+# The menu is read on nearly every rerun but changes rarely, so reads are served
+# from a process-wide cache keyed on menu_version, which triggers on the menu
+# table bump on every insert, update and delete. The counter lives in the
+# database, so a menu change made by another process (the counter importing its
+# bills, database.py --import-menu, the web admin) invalidates this one's cache
+# too. A cache hit costs one primary-key read.
+_menu_cache = None # (menu_version, rows)
+_menu_cache_lock = threading.Lock()
+_menu_cache_stats = {'hits': 0, 'misses': 0}
+
+def _drop_menu_cache():
+    # For changes that fire no trigger, like a migration reshaping the menu table
+    global _menu_cache
+    with _menu_cache_lock:
+        _menu_cache = None
+
+def _read_menu_version(c):
+    c.execute("SELECT version FROM menu_version WHERE id = 1")
+    row = c.fetchone()
+    return row[0] if row else None
+
+@instrumented
+def get_menu_version():
+    # Changes whenever any process changes the menu
+    with read_connection() as conn:
+        return _read_menu_version(conn.cursor())
+
+def get_menu_cache_stats():
+    with _menu_cache_lock:
+        return dict(_menu_cache_stats, version=_menu_cache[0] if _menu_cache is not None else None)
+
+@instrumented
 def get_menu_items():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM menu")
-    items = c.fetchall()
-    conn.close()
-    return items # List of tuples
-
-def add_menu_item(name, price, stock, category, description):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO menu (name, price, stock, category, description) VALUES (?, ?, ?, ?, ?)",
-              (name, price, stock, category, description))
-    conn.commit()
-    conn.close()
+    global _menu_cache
+    with read_connection() as conn:
+        c = conn.cursor()
+        version = _read_menu_version(c)
+        with _menu_cache_lock:
+            cached = _menu_cache[1] if _menu_cache is not None and _menu_cache[0] == version else None
+            _menu_cache_stats['hits' if cached is not None else 'misses'] += 1
+        if cached is not None:
+            return _with_live_stock(cached)
+        c.execute(f"SELECT {_columns(MenuItem)} FROM menu")
+        rows = [MenuItem._make(row) for row in c.fetchall()]
 
-def update_stock(item_id, quantity):
-    conn = get_connection()
-    c = conn.cursor()
+    if version is not None:
+        with _menu_cache_lock:
+            # The version was read first: a write committed in between makes these
+            # rows newer than their tag, so the next read refetches, never the reverse.
+            _menu_cache = (version, rows)
+    return _with_live_stock(rows)
+
+# --- MENU SEARCH ---
+# Prefix search over name, description and category. Results are ranked by
+# bm25 with name matches weighted highest; facets count the matches per
+# category, so the UI can filter by category without another query.
+SEARCH_WEIGHTS = (10.0, 2.0, 5.0) # name, description, category
+
+def _search_terms(query):
+    return re.findall(r"\w+", query.lower())
+
+def _has_menu_fts(c):
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'menu_fts'")
+    return c.fetchone() is not None
+
+def _search_menu_in_memory(items, terms):
+    # Fallback without FTS5: every term must prefix a word of the item
+    scored = []
+    for item in items:
+        fields = [_search_terms(item.name or ""), _search_terms(item.description or ""),
+                  _search_terms(item.category or "")]
+        score = 0.0
+        for term in terms:
+            hits = [weight for words, weight in zip(fields, SEARCH_WEIGHTS) if any(w.startswith(term) for w in words)]
+            if not hits:
+                break
+            score += max(hits)
+        else:
+            scored.append((-score, item.id, item))
+    return [item for _, _, item in sorted(scored)]
+
+@instrumented
+def search_menu(query=""):
+    # Returns {'items': [MenuItem] best match first, 'facets': [(category, count)]}
+    terms = _search_terms(query or "")
+    if not terms:
+        matches = get_menu_items()
+    else:
+        with read_connection() as conn:
+            c = conn.cursor()
+            if _has_menu_fts(c):
+                c.execute(f"""
+                SELECT {_columns(MenuItem, 'm')} FROM menu_fts f JOIN menu m ON m.id = f.rowid
+                WHERE menu_fts MATCH ? ORDER BY bm25(menu_fts, ?, ?, ?)
+                """, (" ".join(f'"{term}"*' for term in terms), *SEARCH_WEIGHTS))
+                matches = _with_live_stock(MenuItem._make(row) for row in c.fetchall())
+            else:
+                matches = None
+        if matches is None:
+            matches = _search_menu_in_memory(get_menu_items(), terms)
+
+    facets = {}
+    for item in matches:
+        facets[item.category] = facets.get(item.category, 0) + 1
+    return {'items': matches, 'facets': sorted(facets.items(), key=lambda f: (-f[1], f[0] or ""))}
+
+def _add_menu_item_tx(c, name, price, stock, category, description, prep_seconds, station, batch_size):
+    c.execute("""
+    INSERT INTO menu (name, price, stock, category, description, prep_seconds, station, batch_size)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (name, price, stock, category, description, prep_seconds, station, batch_size))
+
+@instrumented
+def add_menu_item(name, price, stock, category, description,
+                  prep_seconds=None, station=None, batch_size=1):
+    _run_write(_add_menu_item_tx, name, price, stock, category, description,
+               prep_seconds or DEFAULT_PREP_SECONDS, station or DEFAULT_STATION, batch_size)
+    _refresh_stock_ledger()
+
+def _update_stock_tx(c, item_id, quantity):
     c.execute("UPDATE menu SET stock = stock - ? WHERE id = ?", (quantity, item_id))
-    conn.commit()
-    conn.close()
 
-def update_menu_stock_direct(item_id, new_stock):
-    conn = get_connection()
-    c = conn.cursor()
+@instrumented
+def update_stock(item_id, quantity):
+    _run_write(_update_stock_tx, item_id, quantity)
+    _refresh_stock_ledger()
+
+def _update_menu_stock_direct_tx(c, item_id, new_stock):
+    # A stock count already reflects orders still waiting in stock_pending
+    _apply_pending_stock(c)
     c.execute("UPDATE menu SET stock = ? WHERE id = ?", (new_stock, item_id))
-    conn.commit()
-    conn.close()
+
+@instrumented
+def update_menu_stock_direct(item_id, new_stock):
+    _run_write(_update_menu_stock_direct_tx, item_id, new_stock)
+    _refresh_stock_ledger()
+
+# --- MENU IMPORT / EXPORT ---
+# Bulk load for the whole menu or a morning stock count. Rows are dicts keyed by
+# MENU_FIELDS (from CSV or JSON); a row updates the item with its id, else the
+# item with the same name (case-insensitive), else adds a new item. Blank fields
+# keep the current value. With stock_mode="delta" the stock column is added to
+# the current stock instead of replacing it.
+MENU_FIELDS = list(MenuItem._fields)
+STOCK_MODES = ["absolute", "delta"]
+
+@instrumented
+def export_menu():
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT {_columns(MenuItem)} FROM menu ORDER BY id")
+        return [MenuItem._make(row)._asdict() for row in c.fetchall()]
+
+def format_menu_data(rows, fmt="csv"):
+    if fmt == "json":
+        return json.dumps(rows, indent=2)
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=MENU_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue()
+
+def parse_menu_data(text, fmt="csv"):
+    # Raises ValueError when the file itself is unreadable; bad rows are reported by import_menu
+    if fmt == "json":
+        rows = json.loads(text)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("JSON menu must be a list of objects")
+        return rows
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not {"id", "name"} & {f.strip().lower() for f in reader.fieldnames}:
+        raise ValueError("CSV menu needs a header row with an id or name column")
+    return [{(k or "").strip().lower(): v for k, v in row.items()} for row in reader]
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+def _validate_menu_rows(rows, stock_mode, existing):
+    # existing: {id: [name, stock]}. Returns (inserts, updates, errors); row numbers start at 1.
+    by_name = {}
+    for item_id in sorted(existing, reverse=True):
+        by_name[existing[item_id][0].strip().lower()] = item_id # Lowest id wins for duplicate names
+    stock_after = {item_id: stock or 0 for item_id, (_, stock) in existing.items()}
+    inserts, updates, errors = [], [], []
+    new_names = set()
+    for number, row in enumerate(rows, 1):
+        try:
+            item_id = None if _blank(row.get("id")) else int(row["id"])
+            name = None if _blank(row.get("name")) else str(row["name"]).strip()
+            price = None if _blank(row.get("price")) else float(row["price"])
+            stock = None if _blank(row.get("stock")) else int(float(row["stock"]))
+            prep_seconds = None if _blank(row.get("prep_seconds")) else int(float(row["prep_seconds"]))
+            batch_size = None if _blank(row.get("batch_size")) else int(float(row["batch_size"]))
+        except (TypeError, ValueError):
+            errors.append({'row': number, 'error': "id, price, stock, prep_seconds and batch_size must be numbers"})
+            continue
+        if item_id is not None and item_id not in existing:
+            errors.append({'row': number, 'error': f"no menu item with id {item_id}"})
+            continue
+        if item_id is None and name is None:
+            errors.append({'row': number, 'error': "needs an id or a name"})
+            continue
+        if price is not None and price <= 0:
+            errors.append({'row': number, 'error': "price must be positive"})
+            continue
+        if (prep_seconds is not None and prep_seconds <= 0) or (batch_size is not None and batch_size <= 0):
+            errors.append({'row': number, 'error': "prep_seconds and batch_size must be positive"})
+            continue
+        category = None if _blank(row.get("category")) else str(row["category"]).strip()
+        station = None if _blank(row.get("station")) else str(row["station"]).strip()
+        if item_id is None and name.lower() in by_name:
+            item_id = by_name[name.lower()]
+            name = None # Matched by name: keep the stored spelling
+        if item_id is None:
+            if name.lower() in new_names:
+                errors.append({'row': number, 'error': f"new item '{name}' appears more than once"})
+                continue
+            if price is None:
+                errors.append({'row': number, 'error': f"new item '{name}' needs a price"})
+                continue
+            if stock is not None and stock < 0:
+                errors.append({'row': number, 'error': "stock cannot be negative"})
+                continue
+            inserts.append((name, price, stock or 0, category or "General",
+                            row.get("description") or "", row.get("image_url") or "",
+                            prep_seconds or DEFAULT_PREP_SECONDS, station or DEFAULT_STATION, batch_size or 1))
+            new_names.add(name.lower())
+            continue
+        if stock is not None:
+            new_stock = stock_after[item_id] + stock if stock_mode == "delta" else stock
+            if new_stock < 0:
+                errors.append({'row': number, 'error': f"stock for item {item_id} would go negative ({new_stock})"})
+                continue
+            stock_after[item_id] = new_stock
+        updates.append((name, price, None if stock is None else stock_after[item_id], category,
+                        None if _blank(row.get("description")) else row["description"],
+                        None if _blank(row.get("image_url")) else row["image_url"],
+                        prep_seconds, station, batch_size, item_id))
+    return inserts, updates, errors
+
+def _import_menu_tx(c, rows, stock_mode):
+    _apply_pending_stock(c) # Validate against the real current stock
+    c.execute("SELECT id, name, stock FROM menu")
+    existing = {item_id: [name, stock] for item_id, name, stock in c.fetchall()}
+    inserts, updates, errors = _validate_menu_rows(rows, stock_mode, existing)
+    if errors:
+        return {'ok': False, 'inserted': 0, 'updated': 0, 'errors': errors}
+    # Stock is already resolved to its final value, so deltas and absolutes share one statement
+    c.executemany("""
+    UPDATE menu SET name = COALESCE(?, name), price = COALESCE(?, price), stock = COALESCE(?, stock),
+        category = COALESCE(?, category), description = COALESCE(?, description), image_url = COALESCE(?, image_url),
+        prep_seconds = COALESCE(?, prep_seconds), station = COALESCE(?, station), batch_size = COALESCE(?, batch_size)
+    WHERE id = ?
+    """, updates)
+    c.executemany("""
+    INSERT INTO menu (name, price, stock, category, description, image_url, prep_seconds, station, batch_size)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, inserts)
+    return {'ok': True, 'inserted': len(inserts), 'updated': len(updates), 'errors': []}
+
+@instrumented
+def import_menu(rows, stock_mode="absolute"):
+    # Returns {'ok', 'inserted', 'updated', 'errors': [{'row', 'error'}]}.
+    # All rows are applied in one transaction, or none if any row is invalid.
+    if stock_mode not in STOCK_MODES:
+        raise ValueError(f"stock_mode must be one of {STOCK_MODES}")
+    result = _run_write(_import_menu_tx, rows, stock_mode)
+    if result['ok']:
+        _refresh_stock_ledger()
+    return result
+
+# --- KITCHEN STATIONS ---
+# Capacity model for the prep scheduler: a station works on up to `slots`
+# batches at once. Stations named on menu items but missing here get one slot.
+
+@instrumented
+def get_kitchen_stations():
+    # {station: slots}
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT name, slots FROM kitchen_stations ORDER BY name")
+        return dict(c.fetchall())
+
+def _set_kitchen_stations_tx(c, stations):
+    c.execute("DELETE FROM kitchen_stations")
+    c.executemany("INSERT INTO kitchen_stations (name, slots) VALUES (?, ?)", stations)
+
+@instrumented
+def set_kitchen_stations(stations):
+    # Replaces the whole station list with {station: slots}
+    rows = [(str(name).strip(), int(slots)) for name, slots in stations.items() if str(name).strip()]
+    if any(slots < 1 for _, slots in rows):
+        raise ValueError("every station needs at least one slot")
+    _run_write(_set_kitchen_stations_tx, rows)
+
+# --- ORDER ID ALLOCATION ---
+# Order ids come from blocks reserved in id_sequences, one write per block, and
+# are then handed out from memory. Every process (web app, each CLI counter)
+# reserves its own blocks, so ids never collide and no id needs a round trip.
+# Ids left in a block when a process exits are simply never used.
+# A process that must not wait on the database while handing ids out (the CLI
+# counter) reserves the next block ahead with prefetch_order_id_block from a
+# background thread and allocates with reserve=False.
+ORDER_ID_BLOCK_SIZE = 32
+_order_id_lock = threading.Lock()
+_order_id_block = [0, 0] # [next, end)
+_order_id_spare = [] # Blocks reserved ahead, used once the current one runs out
+
+@instrumented
+def reserve_order_id_block(size):
+    with write_transaction() as conn:
+        c = conn.cursor()
+        c.execute("SELECT next_value FROM id_sequences WHERE name = 'orders'")
+        row = c.fetchone()
+        # Never hand out ids below rows inserted without the allocator
+        c.execute("SELECT COALESCE(MAX(order_id), 0) + 1 FROM orders")
+        start = max(row[0] if row else 1, c.fetchone()[0])
+        c.execute("""
+        INSERT INTO id_sequences (name, next_value) VALUES ('orders', ?)
+        ON CONFLICT(name) DO UPDATE SET next_value = excluded.next_value
+        """, (start + size,))
+    return start, start + size
+
+def allocate_order_id(block_size=None, reserve=True):
+    # With reserve=False this never touches the database and returns None when
+    # no reserved id is left
+    with _order_id_lock:
+        if _order_id_block[0] >= _order_id_block[1]:
+            if _order_id_spare:
+                _order_id_block[:] = _order_id_spare.pop(0)
+            elif reserve:
+                _order_id_block[:] = reserve_order_id_block(block_size or ORDER_ID_BLOCK_SIZE)
+            else:
+                return None
+        order_id = _order_id_block[0]
+        _order_id_block[0] += 1
+        return order_id
+
+def prefetch_order_id_block(block_size=None):
+    # Reserves the next block once the current one is half used and none is spare
+    size = block_size or ORDER_ID_BLOCK_SIZE
+    with _order_id_lock:
+        if _order_id_spare or _order_id_block[1] - _order_id_block[0] > size // 2:
+            return False
+    # Reserved outside the lock, so allocations go on while the database is slow
+    block = reserve_order_id_block(size)
+    with _order_id_lock:
+        _order_id_spare.append(block)
+    return True
+
+# --- STOCK LEDGER ---
+# Optional (CANTEEN_STOCK_LEDGER=1 or start_stock_ledger()). Current stock is
+# held in memory and a whole cart is checked and reserved under one lock, so
+# checkout never reads or updates the hot menu rows. The order transaction
+# appends its decrements to stock_pending instead; a background thread applies
+# them to menu.stock in one batched transaction every STOCK_FLUSH_SECONDS and
+# then reloads the ledger, which also picks up stock changed by other processes
+# (counters, database.py --import-menu). Pending rows commit with their order,
+# so after a crash init_db/start_stock_ledger replay whatever was not applied.
+#
+# Ledger stock = menu.stock - pending rows - reservations whose order has not
+# committed yet (_stock_inflight). Reloads run inside a write transaction, where
+# no order transaction can be half done, so the three always agree.
+STOCK_LEDGER = os.environ.get("CANTEEN_STOCK_LEDGER", "0") == "1"
+STOCK_FLUSH_SECONDS = 1.0
+
+_stock = None # {item_id: available}, None while the ledger is off
+_stock_inflight = {}
+_stock_lock = threading.Lock()
+_stock_start_lock = threading.Lock()
+_stock_flusher = None
+_stock_stop = threading.Event()
+_stock_stats = {'reservations': 0, 'short': 0, 'flushes': 0, 'rows_flushed': 0}
+
+def start_stock_ledger():
+    global _stock_flusher
+    with _stock_start_lock:
+        if _stock_flusher is not None:
+            return
+        _run_write(_sync_stock_ledger_tx) # Crash recovery and initial load
+        _stock_stop.clear()
+        _stock_flusher = threading.Thread(target=_stock_flush_loop, name="canteen-stock-ledger", daemon=True)
+        _stock_flusher.start()
+
+def stop_stock_ledger():
+    # Applies everything still pending before switching the ledger off
+    global _stock, _stock_flusher
+    with _stock_start_lock:
+        if _stock_flusher is None:
+            return
+        _stock_stop.set()
+        _stock_flusher.join()
+        _stock_flusher = None
+        _run_write(_sync_stock_ledger_tx)
+        with _stock_lock:
+            # Orders still in flight write stock_pending rows that the next
+            # init_db or start_stock_ledger applies
+            _stock = None
+            _stock_inflight.clear()
+
+def get_stock_ledger_stats():
+    with _stock_lock:
+        stats = dict(_stock_stats, running=_stock is not None, items=len(_stock or {}),
+                     inflight=sum(_stock_inflight.values()))
+    return stats
+
+def _stock_flush_loop():
+    while not _stock_stop.wait(STOCK_FLUSH_SECONDS):
+        try:
+            _run_write(_sync_stock_ledger_tx)
+        except Exception:
+            logger.exception("Stock ledger flush failed; retrying")
+
+def _apply_pending_stock(c):
+    c.execute("SELECT item_id, SUM(quantity), COUNT(*) FROM stock_pending GROUP BY item_id")
+    totals = c.fetchall()
+    if totals:
+        c.executemany("UPDATE menu SET stock = stock - ? WHERE id = ?", [(qty, item_id) for item_id, qty, _ in totals])
+        c.execute("DELETE FROM stock_pending")
+    return sum(count for _, _, count in totals)
+
+def _sync_stock_ledger_tx(c):
+    global _stock
+    flushed = _apply_pending_stock(c)
+    c.execute("SELECT id, stock FROM menu")
+    rows = c.fetchall()
+    with _stock_lock:
+        _stock = {item_id: (stock or 0) - _stock_inflight.get(item_id, 0) for item_id, stock in rows}
+        _stock_stats['flushes'] += 1
+        _stock_stats['rows_flushed'] += flushed
+
+def _recover_pending_stock():
+    # Decrements left behind by a process that stopped before flushing
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT 1 FROM stock_pending LIMIT 1")
+        if c.fetchone() is None:
+            return
+    if _stock is not None:
+        _run_write(_sync_stock_ledger_tx)
+    else:
+        _run_write(_apply_pending_stock)
+
+def _refresh_stock_ledger():
+    # After a direct stock write in this process, so the ledger shows it at once
+    if _stock is not None:
+        _run_write(_sync_stock_ledger_tx)
+
+def _with_live_stock(items):
+    stock = _stock
+    if stock is None:
+        return list(items)
+    return [item if stock.get(item.id, item.stock) == item.stock else item._replace(stock=stock[item.id])
+            for item in items]
+
+def _reserve_stock(wanted):
+    # All or nothing; returns (reservation or None, {item_id: available before})
+    with _stock_lock:
+        available = {item_id: _stock.get(item_id, 0) for item_id in wanted}
+        if any(qty > available[item_id] for item_id, qty in wanted.items()):
+            _stock_stats['short'] += 1
+            return None, available
+        for item_id, qty in wanted.items():
+            _stock[item_id] -= qty
+            _stock_inflight[item_id] = _stock_inflight.get(item_id, 0) + qty
+        _stock_stats['reservations'] += 1
+    return {'items': wanted, 'available': available, 'settled': False}, available
+
+def _settle_reservation(reservation):
+    # Called inside the order transaction once its stock_pending rows are written
+    with _stock_lock:
+        if _stock is None:
+            return
+        for item_id, qty in reservation['items'].items():
+            _stock_inflight[item_id] -= qty
+        reservation['settled'] = True
+
+def _release_reservation(reservation):
+    with _stock_lock:
+        if _stock is None:
+            return
+        for item_id, qty in reservation['items'].items():
+            if item_id in _stock:
+                _stock[item_id] += qty
+            if not reservation['settled']:
+                _stock_inflight[item_id] -= qty
 
 # --- ORDER FUNCTIONS ---
+@instrumented
 def place_order(user_id, name, mobile, cart_items, total_amount, payment_method, qr_data):
-    conn = get_connection()
-    c = conn.cursor()
+    # Returns {'ok', 'order_id', 'lines'}; every line is 'accepted' or 'short'.
+    # The whole cart commits in one BEGIN IMMEDIATE transaction or not at all.
     date_now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    c.execute("INSERT INTO orders (user_id, customer_name, mobile, order_date, total_amount, status, payment_method, qr_code) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-              (user_id, name, mobile, date_now, total_amount, "Received", payment_method, qr_data))
-    order_id = c.lastrowid
-    
+    # The same menu item may appear on several cart lines
+    wanted = {}
     for item in cart_items:
         # item: {'id': 1, 'name': 'Burger', 'price': 50, 'qty': 2}
-        c.execute("INSERT INTO order_items (order_id, item_name, price, quantity) VALUES (?, ?, ?, ?)",
-                  (order_id, item['name'], item['price'], item['qty']))
-        
-        # Deduct stock
-        c.execute("UPDATE menu SET stock = stock - ? WHERE id = ?", (item['qty'], item['id']))
-        
-    conn.commit()
-    conn.close()
-    return order_id
-
-def get_orders(user_id=None, role="student"):
-    conn = get_connection()
-    c = conn.cursor()
-    if role == "admin" or role == "staff":
-        c.execute("SELECT * FROM orders ORDER BY order_id DESC")
+        wanted[item['id']] = wanted.get(item['id'], 0) + item['qty']
+
+    if STOCK_LEDGER and _stock is None:
+        start_stock_ledger()
+    reservation = None
+    if _stock is not None:
+        reservation, available = _reserve_stock(wanted)
+        if reservation is None:
+            return {'ok': False, 'order_id': None, 'lines': _order_lines(cart_items, wanted, available)}
+
+    # Allocated outside the order transaction so a rollback can never hand it out twice
+    order_id = allocate_order_id()
+    try:
+        result = _run_write(_place_order_tx, order_id, user_id, name, mobile, cart_items, wanted, total_amount,
+                            payment_method, qr_data, date_now, reservation)
+    except Exception:
+        if reservation is not None:
+            _release_reservation(reservation)
+        raise
+    return result
+
+def _order_lines(cart_items, wanted, available):
+    return [{
+        'id': item['id'],
+        'name': item['name'],
+        'qty': item['qty'],
+        'available': available.get(item['id'], 0),
+        'status': "accepted" if wanted[item['id']] <= available.get(item['id'], 0) else "short"
+    } for item in cart_items]
+
+def _place_order_tx(c, order_id, user_id, name, mobile, cart_items, wanted, total_amount, payment_method, qr_data,
+                    date_now, reservation=None):
+    if reservation is not None:
+        # Stock was reserved in the ledger; only record the decrement
+        lines = _order_lines(cart_items, wanted, reservation['available'])
+        c.executemany("INSERT INTO stock_pending (order_id, item_id, quantity) VALUES (?, ?, ?)",
+                      [(order_id, item_id, qty) for item_id, qty in wanted.items()])
     else:
-        c.execute("SELECT * FROM orders WHERE user_id=? ORDER BY order_id DESC", (user_id,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+        placeholders = ",".join("?" * len(wanted))
+        c.execute(f"SELECT id, stock FROM menu WHERE id IN ({placeholders})", list(wanted))
+        lines = _order_lines(cart_items, wanted, dict(c.fetchall()))
+        if any(line['status'] == "short" for line in lines):
+            return {'ok': False, 'order_id': None, 'lines': lines}
 
+        # Conditional decrement: a row only matches while enough stock is left
+        c.executemany("UPDATE menu SET stock = stock - ? WHERE id = ? AND stock >= ?",
+                      [(qty, item_id, qty) for item_id, qty in wanted.items()])
+        if c.rowcount != len(wanted):
+            raise sqlite3.IntegrityError("Stock changed while placing order")
+
+    c.execute("INSERT INTO orders (order_id, user_id, customer_name, mobile, order_date, total_amount, status, payment_method, qr_code) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+              (order_id, user_id, name, mobile, date_now, total_amount, "Received", payment_method, qr_data))
+    c.executemany("INSERT INTO order_items (order_id, item_name, price, quantity) VALUES (?, ?, ?, ?)",
+                  [(order_id, item['name'], item['price'], item['qty']) for item in cart_items])
+    _apply_order_to_rollups(c, order_id, 1)
+    c.execute("INSERT INTO order_events (order_id, event, status) VALUES (?, 'placed', 'Received')", (order_id,))
+    if reservation is not None:
+        _settle_reservation(reservation)
+    return {'ok': True, 'order_id': order_id, 'lines': lines}
+
+@instrumented
+def get_orders(user_id=None, role="student", statuses=None, date_from=None, date_to=None,
+               before_id=None, limit=None, mobile=None, source="live"):
+    # Newest first. Pass the last order_id of a page as before_id to get the next one.
+    # date_from/date_to are "YYYY-MM-DD HH:MM:SS" strings, both inclusive.
+    # source is one of ORDER_SOURCES; only history views should read the archive.
+    where, params = [], []
+    if role not in ("admin", "staff"):
+        where.append("user_id = ?")
+        params.append(user_id)
+    if mobile:
+        where.append("mobile = ?")
+        params.append(mobile)
+    if statuses:
+        where.append(f"status IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if date_from:
+        where.append("order_date >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("order_date <= ?")
+        params.append(date_to)
+    if before_id is not None:
+        where.append("order_id < ?")
+        params.append(before_id)
+
+    sql = " WHERE " + " AND ".join(where) if where else ""
+    sql += " ORDER BY order_id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    with read_connection() as conn:
+        c = conn.cursor()
+        rows = []
+        if source != "archive":
+            c.execute(f"SELECT {_columns(Order)} FROM main.orders" + sql, params)
+            rows = [Order._make(row) for row in c.fetchall()]
+        if source == "live" or not _has_archive(c):
+            return rows
+        c.execute(f"SELECT {_columns(Order)} FROM archive.orders" + sql, params)
+        archived = [Order._make(row) for row in c.fetchall()]
+    if source == "archive":
+        return archived
+    # Merge both newest-first lists; the live copy wins if an order is in both
+    merged = {row.order_id: row for row in archived}
+    merged.update((row.order_id, row) for row in rows)
+    rows = [merged[order_id] for order_id in sorted(merged, reverse=True)]
+    return rows if limit is None else rows[:limit]
+
+@instrumented
 def update_order_status(order_id, new_status):
-    conn = get_connection()
-    c = conn.cursor()
+    # False when no live order matches; archived orders cannot be changed
+    return _run_write(_update_order_status_tx, order_id, new_status)
+
+def _update_order_status_tx(c, order_id, new_status):
+    c.execute("SELECT status FROM orders WHERE order_id = ?", (order_id,))
+    row = c.fetchone()
+    if not row:
+        return False
     c.execute("UPDATE orders SET status = ? WHERE order_id = ?", (new_status, order_id))
-    conn.commit()
-    conn.close()
+    c.execute("INSERT INTO order_events (order_id, event, status) VALUES (?, 'status', ?)", (order_id, new_status))
+    # Cancelling an order takes it out of the sales rollups, un-cancelling restores it
+    was_cancelled, is_cancelled = row[0] == "Cancelled", new_status == "Cancelled"
+    if was_cancelled != is_cancelled:
+        _apply_order_to_rollups(c, order_id, -1 if is_cancelled else 1)
+    return True
 
-def get_order_items(order_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM order_items WHERE order_id=?", (order_id,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+# --- ARCHIVE ---
+# Completed/Cancelled orders older than ARCHIVE_AFTER_DAYS move, with their items,
+# to the attached archive database, one chunk per write transaction so live
+# writers are never held up for long. The live tables then only hold recent
+# history, which keeps the kitchen display, checkout and student views fast.
+# Sales rollups are untouched; the archive is only read when source asks for it.
+# Each database commits on its own in WAL mode, so a crash can leave an order in
+# both; the copy is idempotent and readers prefer the live row.
+ORDER_SOURCES = ["live", "all", "archive"]
+ARCHIVE_AFTER_DAYS = int(os.environ.get("CANTEEN_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_CHUNK_SIZE = 500 # Orders per transaction, at most MAX_SQL_PARAMS
+
+def _has_archive(c):
+    c.execute("SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'orders'")
+    return c.fetchone() is not None
+
+# Columns copied to the archive. Rows are copied by name, so a migration that
+# adds a column to orders/order_items does not break archiving; the new column
+# stays live-only until it is also added here and to the archive tables.
+ARCHIVE_ORDER_COLUMNS = ["order_id", "user_id", "customer_name", "mobile", "order_date", "total_amount",
+                         "status", "payment_method", "qr_code"]
+ARCHIVE_ORDER_ITEM_COLUMNS = ["id", "order_id", "item_name", "price", "quantity"]
+
+def _create_archive_tables(c):
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS archive.orders (
+        order_id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        customer_name TEXT,
+        mobile TEXT,
+        order_date DATETIME,
+        total_amount REAL,
+        status TEXT DEFAULT 'Received',
+        payment_method TEXT,
+        qr_code TEXT
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS archive.order_items (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER,
+        item_name TEXT,
+        price REAL,
+        quantity INTEGER
+    )
+    """)
+    # Archives created before the explicit schema have no primary key on orders
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_archive_orders_id ON orders(order_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_user ON orders(user_id, order_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_mobile ON orders(mobile, order_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_order_items_order ON order_items(order_id)")
+
+def _archive_orders_tx(c, cutoff, chunk_size):
+    c.execute("""
+    SELECT order_id FROM main.orders WHERE status IN ('Completed', 'Cancelled') AND order_date < ? LIMIT ?
+    """, (cutoff, chunk_size))
+    order_ids = [row[0] for row in c.fetchall()]
+    if not order_ids:
+        return 0
+    _create_archive_tables(c)
+    placeholders = ",".join("?" * len(order_ids))
+    order_columns = ", ".join(ARCHIVE_ORDER_COLUMNS)
+    item_columns = ", ".join(ARCHIVE_ORDER_ITEM_COLUMNS)
+    c.execute(f"""
+    INSERT OR REPLACE INTO archive.orders ({order_columns})
+    SELECT {order_columns} FROM main.orders WHERE order_id IN ({placeholders})
+    """, order_ids)
+    c.execute(f"DELETE FROM archive.order_items WHERE order_id IN ({placeholders})", order_ids)
+    c.execute(f"""
+    INSERT INTO archive.order_items ({item_columns})
+    SELECT {item_columns} FROM main.order_items WHERE order_id IN ({placeholders})
+    """, order_ids)
+    c.execute(f"DELETE FROM main.order_items WHERE order_id IN ({placeholders})", order_ids)
+    c.execute(f"DELETE FROM main.order_events WHERE order_id IN ({placeholders})", order_ids)
+    c.execute(f"DELETE FROM main.orders WHERE order_id IN ({placeholders})", order_ids)
+    return len(order_ids)
+
+@instrumented
+def archive_orders(older_than_days=None, chunk_size=ARCHIVE_CHUNK_SIZE):
+    # Returns the number of orders moved to the archive
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    chunk_size = min(chunk_size, MAX_SQL_PARAMS)
+    moved = 0
+    while True:
+        count = _run_write(_archive_orders_tx, cutoff, chunk_size)
+        moved += count
+        if count < chunk_size:
+            return moved
+
+@instrumented
+def get_archive_stats():
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM main.orders")
+        live = c.fetchone()[0]
+        archived = 0
+        if _has_archive(c):
+            c.execute("SELECT COUNT(*) FROM archive.orders")
+            archived = c.fetchone()[0]
+    return {'live_orders': live, 'archived_orders': archived, 'path': archive_path()}
+
+# --- COUNTER (POS) BILLS ---
+@instrumented
+def import_pos_bills(bills):
+    # Bulk-loads journaled counter bills in one transaction. Bills whose bill_id
+    # was already imported are skipped, so a journal can be re-synced safely.
+    # Returns (imported, skipped).
+    # Journals written before counters allocated order ids get theirs here
+    bills = [bill if bill.get('order_id') else dict(bill, order_id=allocate_order_id()) for bill in bills]
+    result = _run_write(_import_pos_bills_tx, bills)
+    if result[0]:
+        _refresh_stock_ledger()
+    return result
+
+def _import_pos_bills_tx(c, bills):
+    _apply_pending_stock(c) # Counter sales are floored at zero against the real stock
+    bill_ids = list({bill['bill_id'] for bill in bills})
+    seen = set()
+    for start in range(0, len(bill_ids), MAX_SQL_PARAMS):
+        chunk = bill_ids[start:start + MAX_SQL_PARAMS]
+        c.execute(f"SELECT bill_id FROM pos_bills WHERE bill_id IN ({','.join('?' * len(chunk))})", chunk)
+        seen.update(row[0] for row in c.fetchall())
+
+    imported = 0
+    for bill in bills:
+        if bill['bill_id'] in seen:
+            continue
+        seen.add(bill['bill_id'])
+        # Counter sales are handed over at the till, so they land as Completed
+        c.execute("INSERT INTO orders (order_id, user_id, customer_name, mobile, order_date, total_amount, status, payment_method, qr_code) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                  (bill['order_id'], None, bill['customer_name'], bill['mobile'], bill['order_date'], bill['grand'],
+                   "Completed", bill['payment'], None))
+        order_id = bill['order_id']
+        c.executemany("INSERT INTO order_items (order_id, item_name, price, quantity) VALUES (?, ?, ?, ?)",
+                      [(order_id, item['name'], item['price'], item['qty']) for item in bill['items']])
+        # The food is already sold; never fail the sync over stock, just floor it at zero
+        c.executemany("UPDATE menu SET stock = MAX(stock - ?, 0) WHERE id = ?",
+                      [(item['qty'], item['id']) for item in bill['items']])
+        c.execute("INSERT INTO pos_bills (bill_id, order_id, terminal, subtotal, discount, gst, parcel) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (bill['bill_id'], order_id, bill.get('terminal'), bill['subtotal'], bill['discount'], bill['gst'],
+                   bill['parcel']))
+        _apply_order_to_rollups(c, order_id, 1)
+        c.execute("INSERT INTO order_events (order_id, event, status) VALUES (?, 'placed', 'Completed')", (order_id,))
+        imported += 1
+    return imported, len(bills) - imported
+
+# --- ORDER CHANGE FEED ---
+# Pollers keep the last seq they applied and ask only for newer events.
+
+@instrumented
+def get_latest_order_seq():
+    # Take this before loading a snapshot so no change between the two is missed
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT COALESCE(MAX(seq), 0) FROM order_events")
+        return c.fetchone()[0]
+
+@instrumented
+def get_order_changes_since(seq, user_id=None):
+    # [(seq, event, order)] in seq order; order is the order's current Order record
+    sql = f"""
+    SELECT e.seq, e.event, {_columns(Order, 'o')} FROM order_events e
+    JOIN orders o ON o.order_id = e.order_id
+    WHERE e.seq > ?"""
+    params = [seq]
+    if user_id is not None:
+        sql += " AND o.user_id = ?"
+        params.append(user_id)
+    sql += " ORDER BY e.seq"
+
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute(sql, params)
+        return [(row[0], row[1], Order._make(row[2:])) for row in c.fetchall()]
+
+@instrumented
+def get_preparing_since(order_ids):
+    # {order_id: "YYYY-MM-DD HH:MM:SS"} when each order last went to "Preparing",
+    # in local time like order_date (event times are stored in UTC)
+    since = {}
+    with read_connection() as conn:
+        c = conn.cursor()
+        for start in range(0, len(order_ids), MAX_SQL_PARAMS):
+            chunk = order_ids[start:start + MAX_SQL_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            c.execute(f"""
+            SELECT order_id, datetime(MAX(created_at), 'localtime') FROM order_events
+            WHERE order_id IN ({placeholders}) AND status = 'Preparing' GROUP BY order_id
+            """, chunk)
+            since.update(c.fetchall())
+    return since
+
+@instrumented
+def get_order_items(order_id, source="live"):
+    with read_connection() as conn:
+        c = conn.cursor()
+        rows = []
+        if source != "archive":
+            c.execute(f"SELECT {_columns(OrderItem)} FROM main.order_items WHERE order_id=?", (order_id,))
+            rows = [OrderItem._make(row) for row in c.fetchall()]
+        if not rows and source != "live" and _has_archive(c):
+            c.execute(f"SELECT {_columns(OrderItem)} FROM archive.order_items WHERE order_id=?", (order_id,))
+            rows = [OrderItem._make(row) for row in c.fetchall()]
+        return rows
+
+@instrumented
+def get_order_items_bulk(order_ids, source="live"):
+    # {order_id: [OrderItem]} for many orders in one round trip per chunk
+    items = {order_id: [] for order_id in order_ids}
+    with read_connection() as conn:
+        c = conn.cursor()
+        if source != "archive":
+            _fetch_order_items(c, "main", list(items), items)
+        if source != "live" and _has_archive(c):
+            _fetch_order_items(c, "archive", [order_id for order_id, rows in items.items() if not rows], items)
+    return items
+
+def _fetch_order_items(c, schema, order_ids, items):
+    for start in range(0, len(order_ids), MAX_SQL_PARAMS):
+        chunk = order_ids[start:start + MAX_SQL_PARAMS]
+        placeholders = ",".join("?" * len(chunk))
+        c.execute(f"SELECT {_columns(OrderItem)} FROM {schema}.order_items WHERE order_id IN ({placeholders}) ORDER BY order_id, id", chunk)
+        for row in c.fetchall():
+            item = OrderItem._make(row)
+            items[item.order_id].append(item)
 
 # --- FEEDBACK ---
-def submit_feedback(user_id, order_id, rating, comment):
-    conn = get_connection()
-    c = conn.cursor()
+# Ratings are aggregated as they are written: _submit_feedback_tx updates the
+# overall, per-item and per-day rows of feedback_rollups in the same
+# transaction as the feedback itself, so satisfaction stats are a few primary
+# key lookups however much feedback there is. Item rows are keyed by the
+# item_name on the rated order, the same key as daily_item_sales.
+RATINGS = [1, 2, 3, 4, 5]
+
+def _apply_feedback_to_rollups(c, feedback_id):
+    c.execute("SELECT order_id, rating, date(created_at, 'localtime') FROM feedback WHERE id = ?", (feedback_id,))
+    row = c.fetchone()
+    if not row or row[1] is None:
+        return
+    order_id, rating, day = row
+    c.execute("SELECT DISTINCT item_name FROM order_items WHERE order_id = ?", (order_id,))
+    keys = [("all", ""), ("day", day)] + [("item", name) for (name,) in c.fetchall()]
+    hits = tuple(int(rating == r) for r in RATINGS)
+    c.executemany("""
+    INSERT INTO feedback_rollups (scope, key, ratings, rating_sum, r1, r2, r3, r4, r5)
+    VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(scope, key) DO UPDATE SET
+        ratings = ratings + 1, rating_sum = rating_sum + excluded.rating_sum,
+        r1 = r1 + excluded.r1, r2 = r2 + excluded.r2, r3 = r3 + excluded.r3,
+        r4 = r4 + excluded.r4, r5 = r5 + excluded.r5
+    """, [(scope, key, rating) + hits for scope, key in keys])
+
+def _submit_feedback_tx(c, user_id, order_id, rating, comment):
     c.execute("INSERT INTO feedback (user_id, order_id, rating, comment) VALUES (?, ?, ?, ?)",
               (user_id, order_id, rating, comment))
-    conn.commit()
-    conn.close()
+    _apply_feedback_to_rollups(c, c.lastrowid)
 
+@instrumented
+def submit_feedback(user_id, order_id, rating, comment):
+    if rating not in RATINGS:
+        raise ValueError(f"rating must be one of {RATINGS}")
+    _run_write(_submit_feedback_tx, user_id, order_id, rating, comment)
+
+@instrumented
 def has_feedback(order_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT 1 FROM feedback WHERE order_id = ?", (order_id,))
-    result = c.fetchone()
-    conn.close()
-    return result is not None
-
-def get_feedbacks():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT f.id, u.username, f.order_id, f.rating, f.comment, f.created_at FROM feedback f JOIN users u ON f.user_id = u.id ORDER BY f.created_at DESC")
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT 1 FROM feedback WHERE order_id = ?", (order_id,))
+        return c.fetchone() is not None
+
+@instrumented
+def get_pending_feedback_order(user_id):
+    # Most recent completed order of this user that has not been rated yet
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""
+        SELECT {_columns(Order, 'o')} FROM orders o
+        WHERE o.user_id = ? AND o.status = 'Completed'
+          AND NOT EXISTS (SELECT 1 FROM feedback f WHERE f.order_id = o.order_id)
+        ORDER BY o.order_id DESC LIMIT 1
+        """, (user_id,))
+        row = c.fetchone()
+        return Order._make(row) if row else None
+
+@instrumented
+def get_feedbacks(before_id=None, limit=None, ratings=None):
+    # Newest first. Pass the last id of a page as before_id to get the next one.
+    where, params = [], []
+    if ratings:
+        where.append(f"f.rating IN ({','.join('?' * len(ratings))})")
+        params.extend(ratings)
+    if before_id is not None:
+        where.append("f.id < ?")
+        params.append(before_id)
+    sql = "SELECT f.id, u.username, f.order_id, f.rating, f.comment, f.created_at FROM feedback f JOIN users u ON f.user_id = u.id"
+    sql += (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY f.id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute(sql, params)
+        return [Feedback._make(row) for row in c.fetchall()]
+
+def _rating_summary(key, ratings, rating_sum, *distribution):
+    return RatingSummary(key, ratings, rating_sum / ratings if ratings else None, tuple(distribution))
+
+@instrumented
+def get_feedback_stats(date_from=None, date_to=None):
+    # {'overall': RatingSummary, 'items': [RatingSummary] by item name, 'daily': [RatingSummary] by day}.
+    # date_from/date_to are inclusive "YYYY-MM-DD" days and limit 'daily' and
+    # 'overall'; item figures are always all-time.
+    columns = "key, ratings, rating_sum, r1, r2, r3, r4, r5"
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT {columns} FROM feedback_rollups WHERE scope = 'day' AND key >= ? AND key <= ? ORDER BY key",
+                  (date_from or "", date_to or "9999-12-31"))
+        day_rows = c.fetchall()
+        c.execute(f"SELECT {columns} FROM feedback_rollups WHERE scope = 'item' ORDER BY key")
+        items = [_rating_summary(*row) for row in c.fetchall()]
+        c.execute(f"SELECT {columns} FROM feedback_rollups WHERE scope = 'all'")
+        row = c.fetchone()
+    if date_from or date_to:
+        row = ["", *([sum(col) for col in zip(*(r[1:] for r in day_rows))] or [0] * 7)]
+    overall = _rating_summary(*row) if row else _rating_summary("", 0, 0, 0, 0, 0, 0, 0)
+    return {'overall': overall, 'items': items, 'daily': [_rating_summary(*r) for r in day_rows]}
 
 # --- ANALYTICS ---
+# Revenue figures come from rollup tables kept up to date inside the same
+# transaction as each order (see _apply_order_to_rollups), so the Overview
+# reads a few rows per day instead of scanning orders and order_items.
+# Cancelled orders are excluded from every rollup.
 
-def get_revenue_stats():
-    conn = get_connection()
-    # Total revenue
-    # Top selling items
-    params = {}
-    
-    df_orders = "SELECT * FROM orders"
-    df_items = "SELECT * FROM order_items"
-    
-    conn.close()
-    return None # Will use pandas in main.py for easier analysis
+def _apply_order_to_rollups(c, order_id, sign):
+    # sign=1 adds an order to the rollups, sign=-1 takes it back out
+    c.execute("""
+    SELECT substr(order_date, 1, 10), CAST(substr(order_date, 12, 2) AS INTEGER), total_amount, payment_method
+    FROM orders WHERE order_id = ?
+    """, (order_id,))
+    row = c.fetchone()
+    if not row or row[0] is None:
+        return # Undated orders are not in the rollups (see _backfill_sales_rollups)
+    day, hour, total, method = row
+    total, method = total or 0, method or "Unknown"
+
+    c.execute("""
+    INSERT INTO daily_sales (day, orders, revenue) VALUES (?, ?, ?)
+    ON CONFLICT(day) DO UPDATE SET orders = orders + excluded.orders, revenue = revenue + excluded.revenue
+    """, (day, sign, sign * total))
+    c.execute("""
+    INSERT INTO hourly_orders (day, hour, orders) VALUES (?, ?, ?)
+    ON CONFLICT(day, hour) DO UPDATE SET orders = orders + excluded.orders
+    """, (day, hour, sign))
+    c.execute("""
+    INSERT INTO daily_payment_sales (day, payment_method, orders, revenue) VALUES (?, ?, ?, ?)
+    ON CONFLICT(day, payment_method) DO UPDATE SET orders = orders + excluded.orders, revenue = revenue + excluded.revenue
+    """, (day, method, sign, sign * total))
+
+    c.execute("""
+    SELECT item_name, COALESCE(SUM(quantity), 0), COALESCE(SUM(price * quantity), 0) FROM order_items
+    WHERE order_id = ? AND item_name IS NOT NULL GROUP BY item_name
+    """, (order_id,))
+    c.executemany("""
+    INSERT INTO daily_item_sales (day, item_name, quantity, revenue) VALUES (?, ?, ?, ?)
+    ON CONFLICT(day, item_name) DO UPDATE SET quantity = quantity + excluded.quantity, revenue = revenue + excluded.revenue
+    """, [(day, name, sign * qty, sign * revenue) for name, qty, revenue in c.fetchall()])
+
+@instrumented
+def rebuild_sales_rollups():
+    # Recompute every rollup from orders/order_items, e.g. after bulk-loading history
+    with write_transaction() as conn:
+        c = conn.cursor()
+        for table in ("daily_sales", "daily_item_sales", "hourly_orders", "daily_payment_sales", "feedback_rollups"):
+            c.execute(f"DELETE FROM {table}")
+        if _has_archive(c):
+            # An order copied to the archive but not yet deleted from main counts once
+            order_columns = ", ".join(ARCHIVE_ORDER_COLUMNS)
+            item_columns = ", ".join(ARCHIVE_ORDER_ITEM_COLUMNS)
+            order_items = (f"(SELECT {item_columns} FROM main.order_items UNION ALL SELECT {item_columns} FROM archive.order_items"
+                           " WHERE order_id NOT IN (SELECT order_id FROM main.orders))")
+            _backfill_sales_rollups(
+                c,
+                f"(SELECT {order_columns} FROM main.orders UNION ALL SELECT {order_columns} FROM archive.orders"
+                " WHERE order_id NOT IN (SELECT order_id FROM main.orders))",
+                order_items)
+            _backfill_feedback_rollups(c, order_items)
+        else:
+            _backfill_sales_rollups(c)
+            _backfill_feedback_rollups(c)
+
+@instrumented
+def get_item_sales_by_day(date_from=None):
+    # [(day "YYYY-MM-DD", item_name, quantity)] from the sales rollups, which
+    # cover archived orders too; date_from is an inclusive "YYYY-MM-DD" day.
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT day, item_name, quantity FROM daily_item_sales WHERE day >= ?", (date_from or "",))
+        return c.fetchall()
+
+@instrumented
+def get_item_sales_by_hour(date_from=None):
+    # [(hour "YYYY-MM-DD HH", item_name, quantity)] from live and archived orders,
+    # cancelled ones excluded; date_from is an inclusive "YYYY-MM-DD" day.
+    # An hour/item can appear twice (once per database), so callers should sum.
+    sql = """
+    SELECT substr(o.order_date, 1, 13) AS hour, i.item_name, SUM(i.quantity)
+    FROM {schema}.orders o JOIN {schema}.order_items i ON i.order_id = o.order_id
+    WHERE o.status != 'Cancelled' AND o.order_date >= ?{extra}
+    GROUP BY hour, i.item_name
+    """
+    params = (date_from or "",)
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute(sql.format(schema="main", extra=""), params)
+        rows = c.fetchall()
+        if _has_archive(c):
+            # An order copied to the archive but not yet deleted from main counts once
+            c.execute(sql.format(schema="archive", extra=" AND o.order_id NOT IN (SELECT order_id FROM main.orders)"),
+                      params)
+            rows.extend(c.fetchall())
+    return rows
+
+@instrumented
+def get_revenue_stats(date_from=None, date_to=None, top_n=5):
+    # date_from/date_to are inclusive "YYYY-MM-DD" days; None means all time
+    where, params = [], []
+    if date_from:
+        where.append("day >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("day <= ?")
+        params.append(date_to)
+    day_filter = (" WHERE " + " AND ".join(where)) if where else ""
+
+    with read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT day, orders, revenue FROM daily_sales{day_filter} ORDER BY day", params)
+        daily = c.fetchall()
+
+        c.execute(f"""
+        SELECT item_name, SUM(quantity) AS qty, SUM(revenue) FROM daily_item_sales{day_filter}
+        GROUP BY item_name HAVING qty > 0 ORDER BY qty DESC LIMIT ?
+        """, params + [top_n])
+        top_items = c.fetchall()
+
+        c.execute(f"SELECT hour, SUM(orders) FROM hourly_orders{day_filter} GROUP BY hour ORDER BY hour", params)
+        hourly = c.fetchall()
+
+        c.execute(f"""
+        SELECT payment_method, SUM(orders), SUM(revenue) FROM daily_payment_sales{day_filter}
+        GROUP BY payment_method ORDER BY SUM(revenue) DESC
+        """, params)
+        payment_split = c.fetchall()
+
+        statuses = ACTIVE_ORDER_STATUSES
+        c.execute(f"SELECT COUNT(*) FROM orders WHERE status IN ({','.join('?' * len(statuses))})", statuses)
+        active_orders = c.fetchone()[0]
+
+    total_orders = sum(row[1] for row in daily)
+    total_revenue = sum(row[2] for row in daily)
+    return {
+        'total_revenue': total_revenue,
+        'total_orders': total_orders,
+        'avg_ticket': total_revenue / total_orders if total_orders else 0.0,
+        'active_orders': active_orders,
+        'daily_revenue': daily,            # [(day, orders, revenue)]
+        'top_items': top_items,            # [(item_name, quantity, revenue)]
+        'hourly_orders': hourly,           # [(hour, orders)]
+        'payment_split': payment_split     # [(payment_method, orders, revenue)]
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Smart Canteen database maintenance")
+    parser.add_argument("--check", action="store_true", help="print EXPLAIN QUERY PLAN for every query")
+    parser.add_argument("--import-menu", metavar="FILE", help="upsert menu items from a .csv or .json file")
+    parser.add_argument("--stock-mode", choices=STOCK_MODES, default="absolute",
+                        help="treat imported stock as the new count or as a change")
+    parser.add_argument("--export-menu", metavar="FILE", help="write the menu to a .csv or .json file")
+    parser.add_argument("--archive-orders", metavar="DAYS", type=int, nargs="?", const=ARCHIVE_AFTER_DAYS,
+                        help=f"move finished orders older than DAYS (default {ARCHIVE_AFTER_DAYS}) to the archive")
+    args = parser.parse_args()
+
+    init_db()
+    print(f"Schema version: {_schema_version()}")
+    if args.check:
+        plans, missed = check_queries()
+        for sql, entry in plans.items():
+            print(f"\n[{entry['function']}] {sql}")
+            for step in entry['plan']:
+                print(f"  {step}")
+        if missed:
+            print(f"\nNot exercised by the check: {', '.join(missed)}")
+    if args.import_menu:
+        fmt = "json" if args.import_menu.lower().endswith(".json") else "csv"
+        with open(args.import_menu, encoding="utf-8-sig") as f:
+            result = import_menu(parse_menu_data(f.read(), fmt), args.stock_mode)
+        for error in result['errors']:
+            print(f"Row {error['row']}: {error['error']}")
+        if result['ok']:
+            print(f"Imported menu: {result['inserted']} added, {result['updated']} updated")
+        else:
+            print(f"Nothing imported: {len(result['errors'])} invalid rows")
+            raise SystemExit(1)
+    if args.export_menu:
+        fmt = "json" if args.export_menu.lower().endswith(".json") else "csv"
+        rows = export_menu()
+        with open(args.export_menu, "w", encoding="utf-8", newline="") as f:
+            f.write(format_menu_data(rows, fmt))
+        print(f"Exported {len(rows)} menu items to {args.export_menu}")
+    if args.archive_orders is not None:
+        moved = archive_orders(args.archive_orders)
+        stats = get_archive_stats()
+        print(f"Archived {moved} orders to {stats['path']} "
+              f"({stats['live_orders']} live, {stats['archived_orders']} archived)")
@@ -0,0 +1,112 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import database as db
+
+# ========= DEMAND FORECAST =========
+# Recommended opening stock per menu item, so the morning stock count is not a
+# guess. Daily history comes from the daily_item_sales rollup and the hourly
+# mix from the last HOURLY_MIX_DAYS of raw orders (get_item_sales_by_hour,
+# already summed per hour in SQL); everything after that is whole-array
+# pandas/NumPy work. Callers that rerun often should cache the result (the
+# Stock Planning page keys it on the order feed and menu version).
+# Model: an item's demand on a weekday is the recency-weighted mean of its
+# daily sales on past days of that weekday (weights halve every HALF_LIFE_WEEKS),
+# plus SERVICE_LEVEL_Z weighted standard deviations of safety stock. Only days
+# the canteen sold anything count, and only from an item's first sale on, so
+# closed days and items added later do not drag the mean down. The day total is
+# spread over the hours with the item's historical hourly mix, which also tells
+# when the current stock runs out.
+
+HISTORY_DAYS = 365
+HOURLY_MIX_DAYS = 56 # Recent enough to follow changes in opening hours, long enough to be smooth
+HALF_LIFE_WEEKS = 4
+SERVICE_LEVEL_Z = 1.28 # ~90% of days without selling out, for normally distributed demand
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+def load_history(today=None, days=HISTORY_DAYS):
+    # (daily, hourly): daily is open days x items, hourly is items x hour of day.
+    # Today is left out; its sales so far are not a whole day.
+    today = today or datetime.date.today()
+    rows = db.get_item_sales_by_day(str(today - datetime.timedelta(days=days)))
+    frame = pd.DataFrame(rows, columns=["day", "item", "qty"])
+    day = pd.to_datetime(frame["day"], format="%Y-%m-%d").rename("day")
+    keep = ((day < pd.Timestamp(today)) & (frame["qty"] > 0)).to_numpy()
+    daily = frame[keep].groupby([day[keep], "item"])["qty"].sum().unstack(fill_value=0)
+
+    rows = db.get_item_sales_by_hour(str(today - datetime.timedelta(days=min(days, HOURLY_MIX_DAYS))))
+    frame = pd.DataFrame(rows, columns=["hour", "item", "qty"])
+    stamp = pd.to_datetime(frame["hour"], format="%Y-%m-%d %H")
+    keep = (stamp < pd.Timestamp(today)).to_numpy()
+    hourly = frame[keep].groupby(["item", stamp[keep].dt.hour.rename("hour")])["qty"].sum().unstack(fill_value=0)
+    return daily, hourly
+
+def weekday_forecast(daily, target_day):
+    # (mean, std) as 7 x items arrays, one row per weekday (Monday first)
+    demand = daily.to_numpy(dtype=float)
+    if not len(demand):
+        zeros = np.zeros((7, demand.shape[1]))
+        return zeros, zeros
+    # An item counts from its first sale on
+    first_sale = (demand > 0).argmax(axis=0)
+    on_menu = (np.arange(len(demand))[:, None] >= first_sale[None, :]).astype(float)
+
+    age_weeks = (pd.Timestamp(target_day) - daily.index).days.to_numpy() / 7
+    weight = 0.5 ** (age_weeks / HALF_LIFE_WEEKS)
+    by_weekday = (daily.index.dayofweek.to_numpy()[None, :] == np.arange(7)[:, None]) * weight[None, :]
+
+    total = by_weekday @ on_menu
+    mean = (by_weekday @ (demand * on_menu)) / np.where(total > 0, total, 1)
+    var = (by_weekday @ (demand ** 2 * on_menu)) / np.where(total > 0, total, 1) - mean ** 2
+
+    # A weekday with no history for an item borrows the item's all-days figures
+    all_total = weight @ on_menu
+    all_mean = (weight @ (demand * on_menu)) / np.where(all_total > 0, all_total, 1)
+    all_var = (weight @ (demand ** 2 * on_menu)) / np.where(all_total > 0, all_total, 1) - all_mean ** 2
+    missing = total == 0
+    mean = np.where(missing, all_mean[None, :], mean)
+    var = np.where(missing, all_var[None, :], var)
+    return mean, np.sqrt(np.clip(var, 0, None))
+
+def forecast_demand(target_day=None, menu=None):
+    # Returns {'target_day', 'history_days', 'items', 'weekday', 'hourly'}:
+    # items is a DataFrame indexed by menu item name with stock, forecast, std,
+    # recommended, to_add and sells_out_at (hour of day, <NA> if the stock lasts);
+    # weekday is items x WEEKDAYS and hourly is items x hour, both expected units.
+    today = datetime.date.today()
+    target_day = target_day or today
+    menu = menu if menu is not None else db.get_menu_items()
+    names = [item.name for item in menu]
+    stock = np.array([item.stock or 0 for item in menu], dtype=float)
+
+    daily, hourly = load_history(today)
+    mean, std = weekday_forecast(daily, target_day)
+    weekday = pd.DataFrame(mean.T, index=daily.columns, columns=WEEKDAYS).reindex(names, fill_value=0.0)
+    spread = pd.DataFrame(std.T, index=daily.columns, columns=WEEKDAYS).reindex(names, fill_value=0.0)
+
+    column = WEEKDAYS[target_day.weekday()]
+    expected = weekday[column].to_numpy()
+    recommended = np.ceil(expected + SERVICE_LEVEL_Z * spread[column].to_numpy())
+
+    mix = hourly.reindex(names, fill_value=0)
+    totals = mix.sum(axis=1).to_numpy(dtype=float)
+    share = mix.to_numpy(dtype=float) / np.where(totals > 0, totals, 1)[:, None]
+    by_hour = pd.DataFrame(share * expected[:, None], index=names, columns=mix.columns)
+
+    # First hour in which expected sales so far exceed the current stock
+    short = by_hour.cumsum(axis=1).to_numpy() > stock[:, None]
+    hours = np.asarray(mix.columns)
+    sells_out_at = np.where(short.any(axis=1), hours[short.argmax(axis=1)] if len(hours) else 0, -1)
+
+    items = pd.DataFrame({
+        'stock': stock.astype(int),
+        'forecast': expected.round(1),
+        'std': spread[column].to_numpy().round(1),
+        'recommended': recommended.astype(int),
+        'to_add': np.clip(recommended - stock, 0, None).astype(int),
+        'sells_out_at': pd.array([None if h < 0 else int(h) for h in sells_out_at], dtype="Int64")
+    }, index=pd.Index(names, name="item"))
+    return {'target_day': target_day, 'history_days': len(daily), 'items': items,
+            'weekday': weekday.round(1), 'hourly': by_hour.round(1)}
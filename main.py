@@ -1,7 +1,12 @@
 import streamlit as st
 import pandas as pd
 import database as db
+import profiler as prof
+import scheduler
+import forecast
 import time
+import json
+import datetime
 import qrcode
 from PIL import Image
 from io import BytesIO
@@ -14,8 +19,11 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+prof.start_rerun()
+
 # --- CUSTOM CSS ---
-st.markdown("""
+with prof.section("css"):
+    st.markdown("""
 <style>
     .stButton>button {
         width: 100%;
@@ -50,43 +58,77 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- INITIALIZATION ---
-if 'db_initialized' not in st.session_state:
-    db.init_db()
-    st.session_state['db_initialized'] = True
+with prof.section("session init"):
+    if 'db_initialized' not in st.session_state:
+        db.init_db()
+        st.session_state['db_initialized'] = True
+
+    if 'user' not in st.session_state:
+        st.session_state['user'] = None
+
+    if 'cart' not in st.session_state:
+        st.session_state['cart'] = []
 
-if 'user' not in st.session_state:
-    st.session_state['user'] = None
+ORDERS_PAGE_SIZE = 25
+ARCHIVED_ORDERS_LIMIT = 200
+FEEDBACK_PAGE_SIZE = 20
+KDS_REFRESH_SECONDS = 2
+ORDER_TRACKING_REFRESH_SECONDS = 5
 
-if 'cart' not in st.session_state:
-    st.session_state['cart'] = []
+# --- PAYMENT QR SETTINGS ---
+QR_BOX_SIZE = 6
+QR_BORDER = 4
+QR_ERROR_CORRECTION = "M" # L, M, Q or H; lower levels give smaller codes
+QR_CACHE_SIZE = 256
+QR_ERROR_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H
+}
 
 # --- HELPER FUNCTIONS ---
 def format_currency(amount):
     return f"₹{amount:.2f}"
 
+def format_eta(eta):
+    minutes = max(int((eta - datetime.datetime.now()).total_seconds() // 60), 0)
+    return f"{eta:%H:%M} (~{minutes} min)" if minutes else f"{eta:%H:%M} (any moment)"
+
 def add_to_cart(item):
     # Check if item already in cart
     for cart_item in st.session_state['cart']:
-        if cart_item['id'] == item[0]:
+        if cart_item['id'] == item.id:
             cart_item['qty'] += 1
-            st.toast(f"Added another {item[1]} to cart!")
+            st.toast(f"Added another {item.name} to cart!")
             return
             
     # Add new item
     st.session_state['cart'].append({
-        'id': item[0],
-        'name': item[1],
-        'price': item[2],
+        'id': item.id,
+        'name': item.name,
+        'price': item.price,
         'qty': 1
     })
-    st.toast(f"{item[1]} added to cart!")
+    st.toast(f"{item.name} added to cart!")
 
-def generate_qr_code(data):
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+# main.py is re-executed on every rerun, so the QR cache has to live in
+# st.cache_data (shared across sessions, LRU-bounded by max_entries).
+@st.cache_data(max_entries=QR_CACHE_SIZE, show_spinner=False)
+def generate_qr_code(data, box_size=QR_BOX_SIZE, error_correction=QR_ERROR_CORRECTION):
+    # Returns encoded PNG bytes for the payload
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=QR_ERROR_LEVELS[error_correction],
+        box_size=box_size,
+        border=QR_BORDER
+    )
     qr.add_data(data)
     qr.make(fit=True)
     img = qr.make_image(fill_color="black", back_color="white")
-    return img
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
 
 # --- PAGES ---
 
@@ -143,25 +185,25 @@ def student_dashboard():
     st.sidebar.title(f"Welcome, {st.session_state['user']['name']}")
     
     # --- FEEDBACK POPUP LOGIC ---
-    # Check if there are any completed orders without feedback
-    my_orders = db.get_orders(st.session_state['user']['id'], "student")
-    pending_feedbacks = [o for o in my_orders if o[6] == "Completed" and not db.has_feedback(o[0])]
+    # Most recent completed order without feedback, in a single query
+    with prof.section("feedback popup"):
+        order_to_rate = db.get_pending_feedback_order(st.session_state['user']['id'])
     
-    if pending_feedbacks:
-        order_to_rate = pending_feedbacks[0] # Take the most recent one
-        with st.container():
-            st.info(f"🌟 Order #{order_to_rate[0]} is Completed! How was your food?")
-            with st.expander("Rate your Meal Now", expanded=True):
-                 with st.form(f"feedback_form_{order_to_rate[0]}"):
-                    rating = st.slider("Rate (1-5)", 1, 5, 5)
-                    comment = st.text_area("Any comments?")
-                    if st.form_submit_button("Submit Feedback"):
-                        db.submit_feedback(st.session_state['user']['id'], order_to_rate[0], rating, comment)
-                        st.success("Thank you for your feedback!")
-                        time.sleep(1)
-                        st.rerun()
+        if order_to_rate:
+            with st.container():
+                st.info(f"🌟 Order #{order_to_rate.order_id} is Completed! How was your food?")
+                with st.expander("Rate your Meal Now", expanded=True):
+                     with st.form(f"feedback_form_{order_to_rate.order_id}"):
+                        rating = st.slider("Rate (1-5)", 1, 5, 5)
+                        comment = st.text_area("Any comments?")
+                        if st.form_submit_button("Submit Feedback"):
+                            db.submit_feedback(st.session_state['user']['id'], order_to_rate.order_id, rating, comment)
+                            st.success("Thank you for your feedback!")
+                            time.sleep(1)
+                            st.rerun()
 
     menu = st.sidebar.radio("Navigation", ["Menu", "My Cart", "My Orders", "Logout"])
+    prof.set_page(f"student/{menu}")
     
     if menu == "Logout":
         st.session_state['user'] = None
@@ -170,100 +212,150 @@ def student_dashboard():
         
     elif menu == "Menu":
         st.markdown("<div class='main-header'>🍔 Canteen Menu</div>", unsafe_allow_html=True)
-        
-        items = db.get_menu_items()
-        
+        menu_grid()
+
+    elif menu == "My Cart":
+        st.markdown("<div class='main-header'>🛒 Your Cart</div>", unsafe_allow_html=True)
+        cart_editor()
+
+    elif menu == "My Orders":
+        st.markdown("<div class='main-header'>📜 Order History</div>", unsafe_allow_html=True)
+        order_tracking()
+        # Older finished orders live in the archive and are only read on request
+        if st.checkbox("Show archived orders"):
+            with prof.section("archived orders"):
+                archived = db.get_orders(st.session_state['user']['id'], "student", source="archive",
+                                         limit=ARCHIVED_ORDERS_LIMIT)
+                items = db.get_order_items_bulk([o.order_id for o in archived], source="archive")
+                with prof.measure("pandas"):
+                    df = pd.DataFrame([(o.order_id, o.order_date, format_currency(o.total_amount), o.status,
+                                        ", ".join(f"{i.quantity}x {i.item_name}" for i in items[o.order_id]))
+                                       for o in archived],
+                                      columns=["Order", "Date", "Total", "Status", "Items"])
+            if archived:
+                st.dataframe(df, hide_index=True)
+            else:
+                st.caption("No archived orders.")
+
+# --- STUDENT FRAGMENTS ---
+# Each of these reruns on its own when one of its widgets is used, so adding an
+# item or changing a quantity does not re-render the whole dashboard.
+
+@st.fragment
+def menu_grid():
+    with prof.fragment("menu grid"):
+        query = st.text_input("Search the menu", placeholder="e.g. paneer, cold coffee, snacks")
+        result = db.search_menu(query)
+        counts = dict(result['facets'])
+        category = st.radio("Category", [None] + list(counts), horizontal=True,
+                            format_func=lambda cat: f"All ({len(result['items'])})" if cat is None else f"{cat} ({counts[cat]})")
+        items = [item for item in result['items'] if category is None or item.category == category]
+        if not items:
+            st.info("No items match your search.")
+
         # Grid layout for menu
-        
+
         cols = st.columns(3)
         for idx, item in enumerate(items):
-            # item: (id, name, price, stock, category, desc, img)
             with cols[idx % 3]:
                 with st.container(border=True):
-                    st.subheader(item[1])
-                    st.markdown(f"**Category:** {item[4]}")
-                    if item[5]:
-                        st.caption(item[5])
-                    st.markdown(f"<div class='price-tag'>{format_currency(item[2])}</div>", unsafe_allow_html=True)
+                    st.subheader(item.name)
+                    st.markdown(f"**Category:** {item.category}")
+                    if item.description:
+                        st.caption(item.description)
+                    st.markdown(f"<div class='price-tag'>{format_currency(item.price)}</div>", unsafe_allow_html=True)
                     
-                    if item[3] > 0:
-                        st.write(f"In Stock: {item[3]}")
-                        if st.button(f"Add {item[1]}", key=f"add_{item[0]}"):
+                    if item.stock > 0:
+                        st.write(f"In Stock: {item.stock}")
+                        if st.button(f"Add {item.name}", key=f"add_{item.id}"):
                             add_to_cart(item)
                     else:
                         st.error("Out of Stock")
 
-    elif menu == "My Cart":
-        st.markdown("<div class='main-header'>🛒 Your Cart</div>", unsafe_allow_html=True)
-        
+@st.fragment
+def cart_editor():
+    with prof.fragment("cart"):
         if not st.session_state['cart']:
             st.info("Your cart is empty. Go to Menu to add items.")
-        else:
-            total = 0
-            for idx, item in enumerate(st.session_state['cart']):
-                col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
-                with col1:
-                    st.write(f"**{item['name']}**")
-                with col2:
-                    st.write(format_currency(item['price']))
-                with col3:
-                    item['qty'] = st.number_input("Qty", min_value=1, value=item['qty'], key=f"qty_{idx}")
-                with col4:
-                    if st.button("🗑️", key=f"del_{idx}"):
-                        st.session_state['cart'].pop(idx)
-                        st.rerun()
-                
-                total += item['price'] * item['qty']
-            
-            st.divider()
-            st.markdown(f"### Total: {format_currency(total)}")
-            
-            # Payment Section
-            st.subheader("Checkout")
-            payment_method = st.radio("Payment Method", ["Cash", "UPI/QR Code"])
+            return
+
+        total = 0
+        for idx, item in enumerate(st.session_state['cart']):
+            col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
+            with col1:
+                st.write(f"**{item['name']}**")
+            with col2:
+                st.write(format_currency(item['price']))
+            with col3:
+                item['qty'] = st.number_input("Qty", min_value=1, value=item['qty'], key=f"qty_{idx}")
+            with col4:
+                if st.button("🗑️", key=f"del_{idx}"):
+                    st.session_state['cart'].pop(idx)
+                    st.rerun(scope="fragment")
             
+            total += item['price'] * item['qty']
+        
+        st.divider()
+        st.markdown(f"### Total: {format_currency(total)}")
+        
+        # Payment Section
+        st.subheader("Checkout")
+        payment_method = st.radio("Payment Method", ["Cash", "UPI/QR Code"])
+        
+        with prof.section("qr"):
             if payment_method == "UPI/QR Code":
-                qr_data = f"upi://pay?pa=canteen@upi&pn=SmartCanteen&am={total}&cu=INR"
-                img = generate_qr_code(qr_data)
-                
-                buf = BytesIO()
-                img.save(buf)
-                st.image(buf, caption="Scan to Pay", width=200)
+                # Fixed amount format so equal totals share one cached QR image
+                qr_data = f"upi://pay?pa=canteen@upi&pn=SmartCanteen&am={total:.2f}&cu=INR"
+                st.image(generate_qr_code(qr_data), caption="Scan to Pay", width=200)
             else:
                 qr_data = "CASH"
 
-            if st.button("Place Order", type="primary"):
-                order_id = db.place_order(
-                    st.session_state['user']['id'],
-                    st.session_state['user']['name'],
-                    "0000000000", # TODO: Store mobile in session
-                    st.session_state['cart'],
-                    total,
-                    payment_method,
-                    qr_data
-                )
-                st.success(f"Order Placed Successfully! Order ID: #{order_id}")
+        if st.button("Place Order", type="primary"):
+            result = db.place_order(
+                st.session_state['user']['id'],
+                st.session_state['user']['name'],
+                "0000000000", # TODO: Store mobile in session
+                st.session_state['cart'],
+                total,
+                payment_method,
+                qr_data
+            )
+            if result['ok']:
+                st.success(f"Order Placed Successfully! Order ID: #{result['order_id']}")
                 st.session_state['cart'] = []
                 st.balloons()
                 time.sleep(2)
                 st.rerun()
+            else:
+                for line in result['lines']:
+                    if line['status'] == "short":
+                        st.error(f"Only {line['available']} {line['name']} left in stock. Please update your cart.")
 
-    elif menu == "My Orders":
-        st.markdown("<div class='main-header'>📜 Order History</div>", unsafe_allow_html=True)
-        orders = db.get_orders(st.session_state['user']['id'], "student")
+@st.fragment(run_every=ORDER_TRACKING_REFRESH_SECONDS)
+def order_tracking():
+    with prof.fragment("order tracking"):
+        user_id = st.session_state['user']['id']
+        tracked = sync_order_view(f"my_orders_{user_id}", lambda: db.get_orders(user_id, "student"), user_id=user_id)
+        waiting = any(o.status in scheduler.QUEUED_STATUSES for o in tracked['orders'].values())
+        eta = scheduler.get_schedule()['eta'] if waiting else {}
         
-        for order in orders:
-            # order: (id, user_id, name, mobile, date, total, status, payment, qr)
-            with st.expander(f"Order #{order[0]} - {order[4]} ({order[6]})"):
-                st.write(f"**Date:** {order[4]}")
-                st.write(f"**Total:** {format_currency(order[5])}")
-                st.write(f"**Status:** {order[6]}")
-                items = db.get_order_items(order[0])
-                st.table(pd.DataFrame(items, columns=["ID", "Order ID", "Item", "Price", "Qty"]).drop(columns=["ID", "Order ID"]))
+        for order_id in sorted(tracked['orders'], reverse=True):
+            order = tracked['orders'][order_id]
+            with st.expander(f"Order #{order.order_id} - {order.order_date} ({order.status})"):
+                st.write(f"**Date:** {order.order_date}")
+                st.write(f"**Total:** {format_currency(order.total_amount)}")
+                st.write(f"**Status:** {order.status}")
+                if order.order_id in eta:
+                    st.write(f"**Expected ready:** {format_eta(eta[order.order_id])}")
+                with prof.measure("pandas"):
+                    df = pd.DataFrame([(i.item_name, i.price, i.quantity) for i in tracked['items'][order.order_id]],
+                                      columns=["Item", "Price", "Qty"])
+                st.table(df)
 
 def admin_dashboard():
     st.sidebar.title("Admin Dashboard")
-    menu = st.sidebar.radio("Go to", ["Overview", "Manage Menu", "All Orders", "Logout"])
+    menu = st.sidebar.radio("Go to", ["Overview", "Manage Menu", "Stock Planning", "All Orders", "Feedback", "Performance", "Logout"])
+    prof.set_page(f"admin/{menu}")
     
     if menu == "Logout":
         st.session_state['user'] = None
@@ -271,12 +363,44 @@ def admin_dashboard():
         
     elif menu == "Overview":
         st.markdown("<div class='main-header'>📊 Admin Overview</div>", unsafe_allow_html=True)
-        # Placeholder for stats
-        col1, col2 = st.columns(2)
+        date_range = st.date_input("Period (leave empty for all time)", value=())
+        date_from = date_to = None
+        if len(date_range) == 2:
+            date_from, date_to = str(date_range[0]), str(date_range[1])
+        with prof.section("revenue stats"):
+            stats = db.get_revenue_stats(date_from, date_to)
+
+        col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Total Revenue", "₹12,450", "+15%")
+            st.metric("Total Revenue", format_currency(stats['total_revenue']))
         with col2:
-            st.metric("Active Orders", "5", "-2")
+            st.metric("Orders", stats['total_orders'])
+        with col3:
+            st.metric("Avg Ticket", format_currency(stats['avg_ticket']))
+        with col4:
+            st.metric("Active Orders", stats['active_orders'])
+
+        if stats['daily_revenue']:
+            st.subheader("Revenue per Day")
+            with prof.measure("pandas"):
+                daily = pd.DataFrame(stats['daily_revenue'], columns=["Day", "Orders", "Revenue"]).set_index("Day")
+                top_items = pd.DataFrame(stats['top_items'], columns=["Item", "Qty", "Revenue"])
+                payment_split = pd.DataFrame(stats['payment_split'], columns=["Method", "Orders", "Revenue"])
+                hourly = pd.DataFrame(stats['hourly_orders'], columns=["Hour", "Orders"]).set_index("Hour")
+            st.line_chart(daily["Revenue"])
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.subheader("Top Selling Items")
+                st.dataframe(top_items, hide_index=True)
+            with col2:
+                st.subheader("Payment Methods")
+                st.dataframe(payment_split, hide_index=True)
+
+            st.subheader("Orders by Hour")
+            st.bar_chart(hourly)
+        else:
+            st.info("No sales in this period yet.")
             
     elif menu == "Manage Menu":
         st.subheader("Add New Item")
@@ -286,15 +410,66 @@ def admin_dashboard():
             stock = st.number_input("Stock", min_value=0)
             cat = st.text_input("Category", value="General")
             desc = st.text_area("Description")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                prep_minutes = st.number_input("Prep Time (min)", min_value=0.5, value=db.DEFAULT_PREP_SECONDS / 60, step=0.5)
+            with col2:
+                station = st.selectbox("Station", sorted(db.get_kitchen_stations()) or [db.DEFAULT_STATION])
+            with col3:
+                batch_size = st.number_input("Batch Size", min_value=1, value=1)
             
             if st.form_submit_button("Add Item"):
-                db.add_menu_item(name, price, stock, cat, desc)
+                db.add_menu_item(name, price, stock, cat, desc, int(prep_minutes * 60), station, batch_size)
+                scheduler.invalidate()
                 st.success("Item Added!")
-                
+
+        st.subheader("Kitchen Stations")
+        st.caption("Slots are how many batches a station can cook at the same time. They drive the prep sequence and ETAs.")
+        stations = st.data_editor(pd.DataFrame(list(db.get_kitchen_stations().items()), columns=["Station", "Slots"]),
+                                  num_rows="dynamic", hide_index=True, key="kitchen_stations")
+        if st.button("Save Stations"):
+            try:
+                db.set_kitchen_stations(dict(zip(stations["Station"].fillna(""), stations["Slots"].fillna(1))))
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                scheduler.invalidate()
+                st.success("Stations saved")
+
+        st.subheader("Bulk Import / Export")
+        st.caption("Rows update the item with the same id or name and add the rest. Blank cells keep the current value.")
+        upload = st.file_uploader("Menu or stock count file", type=["csv", "json"])
+        stock_mode = st.radio("Stock column", db.STOCK_MODES, horizontal=True,
+                              format_func=lambda m: "Set stock to count" if m == "absolute" else "Add to current stock")
+        if upload is not None and st.button("Import"):
+            fmt = "json" if upload.name.lower().endswith(".json") else "csv"
+            try:
+                result = db.import_menu(db.parse_menu_data(upload.getvalue().decode("utf-8-sig"), fmt), stock_mode)
+            except (ValueError, UnicodeDecodeError) as e:
+                st.error(f"Could not read {upload.name}: {e}")
+            else:
+                if result['ok']:
+                    scheduler.invalidate()
+                    st.success(f"Imported: {result['inserted']} added, {result['updated']} updated")
+                else:
+                    st.error(f"Nothing imported: {len(result['errors'])} invalid rows")
+                    st.dataframe(pd.DataFrame(result['errors']), hide_index=True)
+
+        menu_rows = db.export_menu()
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("Export CSV", db.format_menu_data(menu_rows, "csv"), "menu.csv", "text/csv")
+        with col2:
+            st.download_button("Export JSON", db.format_menu_data(menu_rows, "json"), "menu.json", "application/json")
+
         st.subheader("Existing Menu")
         items = db.get_menu_items()
+        cache_stats = db.get_menu_cache_stats()
+        st.caption(f"Menu cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses (version {cache_stats['version']})")
         try:
-            df = pd.DataFrame(items, columns=["ID", "Name", "Price", "Stock", "Category", "Description", "Image"])
+            with prof.measure("pandas"):
+                df = pd.DataFrame(items, columns=["ID", "Name", "Price", "Stock", "Category", "Description", "Image",
+                                                  "Prep (s)", "Station", "Batch"])
             st.dataframe(df)
         except ValueError as e:
             st.error(f"Error displaying menu: {e}")
@@ -303,24 +478,265 @@ def admin_dashboard():
 
     elif menu == "All Orders":
         st.subheader("All Orders")
-        orders = db.get_orders(role="admin")
-        
-        for order in orders:
-             with st.expander(f"Order #{order[0]} - {order[2]} - {order[6]}"):
-                status_opts = ["Received", "Preparing", "Ready", "Completed", "Cancelled"]
-                curr_status_idx = status_opts.index(order[6]) if order[6] in status_opts else 0
-                new_status = st.selectbox("Update Status", status_opts, index=curr_status_idx, key=f"status_{order[0]}")
-                
-                if new_status != order[6]:
-                    db.update_order_status(order[0], new_status)
-                    st.toast(f"Order #{order[0]} updated to {new_status}")
-                    time.sleep(1)
-                    st.rerun()
+        col1, col2 = st.columns(2)
+        with col1:
+            status_filter = st.multiselect("Status", db.ORDER_STATUSES)
+        with col2:
+            date_range = st.date_input("Order Date", value=())
+        include_archive = st.checkbox("Include archived orders")
+        date_from = date_to = None
+        if len(date_range) == 2:
+            date_from = f"{date_range[0]} 00:00:00"
+            date_to = f"{date_range[1]} 23:59:59"
+
+        # Keyset pagination: stack of before_id cursors, reset when filters change
+        filters = (tuple(status_filter), date_from, date_to, include_archive)
+        if st.session_state.get('admin_order_filters') != filters:
+            st.session_state['admin_order_filters'] = filters
+            st.session_state['admin_order_cursors'] = [None]
+        cursors = st.session_state['admin_order_cursors']
+
+        with prof.section("order list"):
+            orders = db.get_orders(role="admin", statuses=status_filter, date_from=date_from, date_to=date_to,
+                                   before_id=cursors[-1], limit=ORDERS_PAGE_SIZE + 1,
+                                   source="all" if include_archive else "live")
+            has_next = len(orders) > ORDERS_PAGE_SIZE
+            orders = orders[:ORDERS_PAGE_SIZE]
+            # Archived orders are history: shown read-only. The live query takes the
+            # same cursor and limit, so it holds every live order on this page.
+            live_ids = {o.order_id for o in orders}
+            if include_archive:
+                live_ids = {o.order_id for o in db.get_orders(role="admin", statuses=status_filter,
+                                                              date_from=date_from, date_to=date_to,
+                                                              before_id=cursors[-1], limit=ORDERS_PAGE_SIZE + 1)}
+            
+            for order in orders:
+                 archived = order.order_id not in live_ids
+                 with st.expander(f"Order #{order.order_id} - {order.customer_name} - {order.status}"
+                                  + (" (archived)" if archived else "")):
+                    if archived:
+                        st.write(f"**Status:** {order.status}")
+                        continue
+                    status_opts = db.ORDER_STATUSES
+                    curr_status_idx = status_opts.index(order.status) if order.status in status_opts else 0
+                    new_status = st.selectbox("Update Status", status_opts, index=curr_status_idx, key=f"status_{order.order_id}")
+                    
+                    if new_status != order.status:
+                        if db.update_order_status(order.order_id, new_status):
+                            st.toast(f"Order #{order.order_id} updated to {new_status}")
+                            time.sleep(1)
+                            st.rerun()
+                        st.error(f"Order #{order.order_id} is no longer live and cannot be updated.")
+
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if st.button("⬅️ Newer", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+        with col2:
+            st.caption(f"Page {len(cursors)}")
+        with col3:
+            if st.button("Older ➡️", disabled=not has_next):
+                cursors.append(orders[-1].order_id)
+                st.rerun()
+
+    elif menu == "Stock Planning":
+        stock_planning_page()
+
+    elif menu == "Feedback":
+        feedback_page()
+
+    elif menu == "Performance":
+        performance_page()
+
+def feedback_page():
+    st.markdown("<div class='main-header'>🌟 Customer Feedback</div>", unsafe_allow_html=True)
+    date_range = st.date_input("Period (leave empty for all time)", value=())
+    date_from = date_to = None
+    if len(date_range) == 2:
+        date_from, date_to = str(date_range[0]), str(date_range[1])
+    with prof.section("feedback stats"):
+        stats = db.get_feedback_stats(date_from, date_to)
+    overall = stats['overall']
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Ratings", overall.count)
+    with col2:
+        st.metric("Average Rating", f"{overall.mean:.2f} / 5" if overall.count else "n/a")
+    with col3:
+        st.metric("4-5 Stars", f"{sum(overall.distribution[3:]) / overall.count:.0%}" if overall.count else "n/a")
+
+    if overall.count:
+        with prof.measure("pandas"):
+            distribution = pd.DataFrame({"Ratings": overall.distribution}, index=[f"{r}★" for r in db.RATINGS])
+            daily = pd.DataFrame([(d.key, d.count, d.mean) for d in stats['daily']],
+                                 columns=["Day", "Ratings", "Average"]).set_index("Day")
+            items = pd.DataFrame([(i.key, i.count, round(i.mean, 2), *i.distribution) for i in stats['items']],
+                                 columns=["Item", "Ratings", "Average"] + [f"{r}★" for r in db.RATINGS])
+        col1, col2 = st.columns(2)
+        with col1:
+            st.subheader("Rating Distribution")
+            st.bar_chart(distribution)
+        with col2:
+            st.subheader("Average Rating per Day")
+            st.line_chart(daily["Average"])
+        st.subheader("Ratings per Item (all time, lowest first)")
+        st.dataframe(items.sort_values(["Average", "Ratings"], ascending=[True, False]), hide_index=True)
+
+    st.subheader("Latest Feedback")
+    rating_filter = st.multiselect("Rating", db.RATINGS)
+    # Keyset pagination: stack of before_id cursors, reset when the filter changes
+    if st.session_state.get('feedback_filter') != tuple(rating_filter):
+        st.session_state['feedback_filter'] = tuple(rating_filter)
+        st.session_state['feedback_cursors'] = [None]
+    cursors = st.session_state['feedback_cursors']
+    with prof.section("feedback feed"):
+        feedbacks = db.get_feedbacks(before_id=cursors[-1], limit=FEEDBACK_PAGE_SIZE + 1, ratings=rating_filter)
+    has_next = len(feedbacks) > FEEDBACK_PAGE_SIZE
+    feedbacks = feedbacks[:FEEDBACK_PAGE_SIZE]
+    for fb in feedbacks:
+        st.write(f"{'★' * fb.rating}{'☆' * (5 - fb.rating)} **{fb.username}** on Order #{fb.order_id} ({fb.created_at})")
+        if fb.comment:
+            st.caption(fb.comment)
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Newer", disabled=len(cursors) == 1, key="feedback_newer"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Page {len(cursors)}")
+    with col3:
+        if st.button("Older ➡️", disabled=not has_next, key="feedback_older"):
+            cursors.append(feedbacks[-1].id)
+            st.rerun()
+
+# The forecast reads a year of sales, so it is cached and only recomputed when
+# an order or the menu (including stock) changed, or the day rolled over; reruns
+# that only switch the item chart reuse it.
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_forecast(target_day, today, order_seq, menu_version):
+    return forecast.forecast_demand(target_day)
+
+def stock_planning_page():
+    st.markdown("<div class='main-header'>📦 Stock Planning</div>", unsafe_allow_html=True)
+    target_day = st.date_input("Plan for", value=datetime.date.today())
+    menu_items = db.get_menu_items()
+    with prof.section("demand forecast"):
+        plan = cached_forecast(target_day, datetime.date.today(), db.get_latest_order_seq(), db.get_menu_version())
+    st.caption(f"Forecast from {plan['history_days']} trading days of history, weighted towards recent weeks. "
+               f"Recommended stock covers about 90% of {target_day:%A}s without selling out.")
+
+    items = plan['items']
+    st.dataframe(items.rename(columns={'stock': "Current Stock", 'forecast': "Expected Sales", 'std': "Spread",
+                                       'recommended': "Recommended", 'to_add': "To Add",
+                                       'sells_out_at': "Sells Out At (hour)"}))
+    ids = {item.name: item.id for item in menu_items}
+    short = items[items['to_add'] > 0]
+    if st.button(f"Top up {len(short)} items to recommended stock", disabled=short.empty):
+        result = db.import_menu([{'id': ids[name], 'stock': int(row['recommended'])} for name, row in short.iterrows()])
+        if result['ok']:
+            st.success(f"Stock updated for {result['updated']} items")
+            st.rerun()
+        st.error(f"Stock not updated: {result['errors']}")
+
+    if not items.empty:
+        item = st.selectbox("Item", list(items.index))
+        col1, col2 = st.columns(2)
+        with col1:
+            st.subheader("Expected Sales by Weekday")
+            st.bar_chart(plan['weekday'].loc[item])
+        with col2:
+            st.subheader(f"Expected Sales by Hour ({target_day:%a})")
+            st.bar_chart(plan['hourly'].loc[item])
+
+def performance_page():
+    st.markdown("<div class='main-header'>⏱️ Performance</div>", unsafe_allow_html=True)
+    stats = db.get_query_stats()
+    cache_stats = db.get_menu_cache_stats()
+    queue_stats = db.get_write_queue_stats()
+    ledger_stats = db.get_stock_ledger_stats()
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Connections Opened", stats['connections_opened'])
+    with col2:
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        st.metric("Menu Cache Hit Rate", f"{cache_stats['hits'] / lookups:.0%}" if lookups else "n/a")
+    with col3:
+        st.metric("Write Queue Depth", queue_stats['queue_depth'])
+    with col4:
+        st.metric("Avg Commit Batch", f"{queue_stats['avg_batch_size']:.1f}")
+
+    if ledger_stats['running']:
+        st.caption(f"Stock ledger: {ledger_stats['items']} items, {ledger_stats['reservations']} carts reserved, "
+                   f"{ledger_stats['short']} short, {ledger_stats['rows_flushed']} decrements written in "
+                   f"{ledger_stats['flushes']} flushes")
+
+    if not db.INSTRUMENTATION:
+        st.info("Instrumentation is off. Start the app with CANTEEN_INSTRUMENTATION=1 to collect query stats.")
+
+    st.subheader("Database Functions")
+    if stats['functions']:
+        df = pd.DataFrame.from_dict(stats['functions'], orient="index").sort_values("total_ms", ascending=False)
+        st.dataframe(df)
+
+    st.subheader("SQL Statements")
+    if stats['statements']:
+        df = pd.DataFrame.from_dict(stats['statements'], orient="index").sort_values("total_ms", ascending=False)
+        st.dataframe(df.head(50))
+
+    st.subheader(f"Slow Queries (≥ {stats['slow_query_ms']:.0f} ms)")
+    if not stats['slow_queries']:
+        st.caption("No slow queries recorded.")
+    for entry in reversed(stats['slow_queries']):
+        with st.expander(f"{entry['at']} - {entry['function']} - {entry['ms']} ms"):
+            st.code(entry['sql'], language="sql")
+            for step in entry['plan']:
+                st.write(f"- {step}")
+
+    st.subheader("Page Rerun Profiles")
+    profiling = st.toggle("Profile every rerun", value=prof.ENABLED)
+    if profiling != prof.ENABLED:
+        prof.set_enabled(profiling)
+        st.rerun()
+    profile = prof.get_profile_stats()
+    if profile['pages']:
+        pages = pd.DataFrame.from_dict(profile['pages'], orient="index")
+        st.dataframe(pages.drop(columns=["histogram"]).sort_values("mean_ms", ascending=False))
+        page = st.selectbox("Rerun time histogram", list(profile['pages']))
+        st.bar_chart(pd.Series(profile['pages'][page]['histogram'], name="Reruns"))
+        st.dataframe(pd.DataFrame.from_dict(profile['sections'], orient="index").sort_values("mean_ms", ascending=False))
+    else:
+        st.caption("No reruns profiled yet. Turn profiling on and use the app.")
+
+    st.subheader("Order Archive")
+    archive = db.get_archive_stats()
+    st.caption(f"{archive['live_orders']} live orders, {archive['archived_orders']} archived in {archive['path']}")
+    days = st.number_input("Archive completed and cancelled orders older than (days)", min_value=1,
+                           value=db.ARCHIVE_AFTER_DAYS)
+    if st.button("Archive Now"):
+        with st.spinner("Archiving..."):
+            moved = db.archive_orders(int(days))
+        st.success(f"Archived {moved} orders")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        export = dict(stats, page_profiles=profile)
+        st.download_button("Download Stats (JSON)", json.dumps(export, indent=2),
+                           file_name="canteen_query_stats.json", mime="application/json")
+    with col2:
+        if st.button("Reset Stats"):
+            db.reset_query_stats()
+            prof.reset()
+            st.rerun()
 
 def staff_dashboard():
     # Similar to Admin but restricted
     st.sidebar.title("Staff Dashboard")
     menu = st.sidebar.radio("Go to", ["Live Orders", "Menu Stock", "Logout"])
+    prof.set_page(f"staff/{menu}")
     
     if menu == "Logout":
         st.session_state['user'] = None
@@ -328,38 +744,94 @@ def staff_dashboard():
         
     elif menu == "Live Orders":
         st.header("Kitchen Display")
-        orders = db.get_orders(role="staff")
-        active_orders = [o for o in orders if o[6] not in ["Completed", "Cancelled"]]
-        
-        for order in active_orders:
+        kitchen_display()
+
+def sync_order_view(key, load_snapshot, user_id=None, active_only=False):
+    # First call loads a snapshot of orders; later calls apply only the events
+    # logged since the last one, so polling never rescans the orders table.
+    view = st.session_state.get(key)
+    if view is None:
+        seq = db.get_latest_order_seq()
+        orders = load_snapshot()
+        view = st.session_state[key] = {
+            'seq': seq,
+            'orders': {o.order_id: o for o in orders},
+            'items': db.get_order_items_bulk([o.order_id for o in orders])
+        }
+        return view
+
+    for seq, event, order in db.get_order_changes_since(view['seq'], user_id):
+        view['seq'] = seq
+        if not active_only or order.status in db.ACTIVE_ORDER_STATUSES:
+            view['orders'][order.order_id] = order
+        else:
+            view['orders'].pop(order.order_id, None)
+            view['items'].pop(order.order_id, None)
+
+    new_ids = [order_id for order_id in view['orders'] if order_id not in view['items']]
+    if new_ids:
+        view['items'].update(db.get_order_items_bulk(new_ids))
+    return view
+
+@st.fragment(run_every=KDS_REFRESH_SECONDS)
+def kitchen_display():
+    with prof.fragment("kitchen display"):
+        kds = sync_order_view("kds", lambda: db.get_orders(role="staff", statuses=db.ACTIVE_ORDER_STATUSES),
+                              active_only=True)
+        schedule = scheduler.get_schedule()
+
+        if schedule['batches']:
+            st.subheader("Prep Sequence")
+            with prof.measure("pandas"):
+                df = pd.DataFrame([(b['start'].strftime("%H:%M"), b['station'], b['quantity'], b['item_name'],
+                                    ", ".join(f"#{o}" for o in b['orders']), b['end'].strftime("%H:%M"))
+                                   for b in schedule['batches']],
+                                  columns=["Start", "Station", "Qty", "Item", "Orders", "Done"])
+            st.dataframe(df, hide_index=True)
+            st.divider()
+
+        # Tickets in predicted ready order; Ready orders (no ETA) last, newest first
+        rank = {order_id: i for i, order_id in enumerate(schedule['sequence'])}
+        for order_id in sorted(kds['orders'], key=lambda o: (rank.get(o, len(rank)), -o)):
+            order = kds['orders'][order_id]
             col1, col2 = st.columns([3, 1])
             with col1:
-                st.subheader(f"Order #{order[0]} ({order[6]})")
-                st.write(f"Customer: {order[2]}")
-                items = db.get_order_items(order[0])
-                for item in items:
-                    st.write(f"- {item[4]} x {item[2]}")
+                st.subheader(f"Order #{order.order_id} ({order.status})")
+                st.write(f"Customer: {order.customer_name}")
+                if order.order_id in schedule['eta']:
+                    st.write(f"ETA: {format_eta(schedule['eta'][order.order_id])}")
+                for item in kds['items'][order.order_id]:
+                    st.write(f"- {item.quantity} x {item.item_name}")
             with col2:
-                if st.button("Mark Ready", key=f"ready_{order[0]}"):
-                     db.update_order_status(order[0], "Ready")
-                     st.rerun()
-                if st.button("Mark Completed", key=f"comp_{order[0]}"):
-                     db.update_order_status(order[0], "Completed")
-                     st.rerun()
+                # Starting an order anchors its ETA, which then counts down
+                if order.status == "Received" and st.button("Start", key=f"start_{order.order_id}"):
+                     db.update_order_status(order.order_id, "Preparing")
+                     st.rerun(scope="fragment")
+                if st.button("Mark Ready", key=f"ready_{order.order_id}"):
+                     db.update_order_status(order.order_id, "Ready")
+                     st.rerun(scope="fragment")
+                if st.button("Mark Completed", key=f"comp_{order.order_id}"):
+                     db.update_order_status(order.order_id, "Completed")
+                     st.rerun(scope="fragment")
             st.divider()
 
 # --- MAIN APP ROUTER ---
 def main():
-    if not st.session_state['user']:
-        login_page()
-    else:
-        role = st.session_state['user']['role']
-        if role == 'admin':
-            admin_dashboard()
-        elif role == 'staff':
-            staff_dashboard()
+    try:
+        if not st.session_state['user']:
+            prof.set_page("login")
+            login_page()
         else:
-            student_dashboard()
+            role = st.session_state['user']['role']
+            if role == 'admin':
+                admin_dashboard()
+            elif role == 'staff':
+                staff_dashboard()
+            else:
+                student_dashboard()
+    finally:
+        # Also runs when st.rerun() cuts the script short
+        prof.end_rerun()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+import database as db
+
+# ========= STREAMLIT RERUN PROFILER =========
+# Opt-in (CANTEEN_PROFILE=1 or the toggle on the admin Performance page).
+# main.py marks each rerun with start_rerun()/end_rerun(), names the page with
+# set_page() and wraps the expensive regions in section(). Inside a section,
+# time is split into database calls (reported by database.py), pandas work
+# (wrapped in measure("pandas")) and everything else, which is widget rendering.
+# Fragments that rerun on their own are recorded as pages named "fragment/<name>".
+# Stats live in this module, not in main.py, because Streamlit re-executes
+# main.py on every rerun.
+
+ENABLED = os.environ.get("CANTEEN_PROFILE", "0") == "1"
+HISTORY_SIZE = 500
+HISTOGRAM_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000]
+
+_lock = threading.Lock()
+_pages = {}     # page -> deque of rerun totals {'total', 'db', 'pandas'}
+_sections = {}  # (page, section) -> deque of the same
+_current = threading.local()
+
+def set_enabled(enabled):
+    global ENABLED
+    ENABLED = enabled
+
+def _on_db_call(name, elapsed_ms):
+    run = getattr(_current, 'run', None)
+    if run is not None:
+        if run['open']:
+            run['open'][-1]['db'] += elapsed_ms
+        run['db'] += elapsed_ms
+
+db.add_call_listener(_on_db_call)
+
+def start_rerun(page="app"):
+    _current.run = {'page': page, 'start': time.perf_counter(), 'db': 0.0, 'pandas': 0.0,
+                    'open': [], 'sections': []} if ENABLED else None
+
+def set_page(page):
+    run = getattr(_current, 'run', None)
+    if run is not None:
+        run['page'] = page
+
+def end_rerun():
+    run = getattr(_current, 'run', None)
+    _current.run = None
+    if run is None:
+        return
+    total = (time.perf_counter() - run['start']) * 1000
+    with _lock:
+        _pages.setdefault(run['page'], deque(maxlen=HISTORY_SIZE)).append(
+            {'total': total, 'db': run['db'], 'pandas': run['pandas']})
+        for name, timing in run['sections']:
+            _sections.setdefault((run['page'], name), deque(maxlen=HISTORY_SIZE)).append(timing)
+
+@contextmanager
+def _section(run, name):
+    timing = {'total': 0.0, 'db': 0.0, 'pandas': 0.0}
+    run['open'].append(timing)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing['total'] = (time.perf_counter() - start) * 1000
+        run['open'].pop()
+        # Time spent in a nested section also counts towards its parent
+        if run['open']:
+            run['open'][-1]['db'] += timing['db']
+            run['open'][-1]['pandas'] += timing['pandas']
+        run['sections'].append((name, timing))
+
+def section(name):
+    run = getattr(_current, 'run', None)
+    return _section(run, name) if run is not None else nullcontext()
+
+@contextmanager
+def _fragment_run(name):
+    start_rerun(f"fragment/{name}")
+    try:
+        yield
+    finally:
+        end_rerun()
+
+def fragment(name):
+    # A fragment is a section of a full rerun, or its own rerun when it reruns alone
+    if getattr(_current, 'run', None) is not None:
+        return section(name)
+    return _fragment_run(name) if ENABLED else nullcontext()
+
+@contextmanager
+def _measure(run, category):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        run[category] += elapsed
+        if run['open']:
+            run['open'][-1][category] += elapsed
+
+def measure(category):
+    # Only "pandas" is measured this way; database time is reported by database.py
+    run = getattr(_current, 'run', None)
+    return _measure(run, category) if run is not None else nullcontext()
+
+# --- REPORTING ---
+def _summary(timings):
+    totals = sorted(t['total'] for t in timings)
+    n = len(totals)
+    db_ms = sum(t['db'] for t in timings) / n
+    pandas_ms = sum(t['pandas'] for t in timings) / n
+    mean = sum(totals) / n
+    return {
+        'reruns': n,
+        'mean_ms': round(mean, 2),
+        'p50_ms': round(totals[n // 2], 2),
+        'p95_ms': round(totals[min(n - 1, int(n * 0.95))], 2),
+        'max_ms': round(totals[-1], 2),
+        'db_ms': round(db_ms, 2),
+        'pandas_ms': round(pandas_ms, 2),
+        'render_ms': round(max(mean - db_ms - pandas_ms, 0.0), 2)
+    }
+
+def _histogram(timings):
+    labels = [f"<{b}ms" for b in HISTOGRAM_BUCKETS_MS] + [f">={HISTOGRAM_BUCKETS_MS[-1]}ms"]
+    counts = [0] * len(labels)
+    for t in timings:
+        index = next((i for i, b in enumerate(HISTOGRAM_BUCKETS_MS) if t['total'] < b), len(HISTOGRAM_BUCKETS_MS))
+        counts[index] += 1
+    return dict(zip(labels, counts))
+
+def get_profile_stats():
+    with _lock:
+        pages = {page: dict(_summary(timings), histogram=_histogram(timings))
+                 for page, timings in _pages.items() if timings}
+        sections = {f"{page} / {name}": _summary(timings)
+                    for (page, name), timings in _sections.items() if timings}
+    return {'enabled': ENABLED, 'pages': pages, 'sections': sections}
+
+def reset():
+    with _lock:
+        _pages.clear()
+        _sections.clear()
+
+def dump(path):
+    with open(path, "w") as f:
+        json.dump(get_profile_stats(), f, indent=2)
@@ -0,0 +1,133 @@
+import datetime
+import threading
+import time
+
+import database as db
+
+# ========= KITCHEN PREP SCHEDULER =========
+# Turns the active orders into a prep sequence and a predicted ready time per
+# order. Orders are taken first come, first served ("Preparing" before
+# "Received"). Identical items are batched across orders up to the item's
+# batch_size, so ten portions of fries from five orders are one fryer batch
+# that takes one prep_seconds. Batches are then list-scheduled on their
+# station: each goes to the station slot that frees up first. An order is
+# ready when the last batch holding one of its items is done.
+# Work is anchored to the order feed, not to the moment of the recompute: a
+# "Preparing" order's batches start when it went to Preparing, so its ETA
+# counts down. "Received" orders have not been started, so their work starts
+# no earlier than now (and no earlier than they were placed). A batch still in
+# the queue is not done yet, so it never ends before now. ETAs are estimates.
+# One schedule is shared by every session in the process (the kitchen display
+# and each student tracking an order) and recomputed when an order changes,
+# at most every MIN_INTERVAL_SECONDS, so polling students cost two cheap queries.
+# Menu changes (prep times, stations) count as changes too, including ones made
+# by another process such as database.py --import-menu.
+
+MIN_INTERVAL_SECONDS = 2
+MAX_AGE_SECONDS = 30 # Recompute even without changes, so waiting work slides forward
+QUEUED_STATUSES = ["Preparing", "Received"] # Ready orders need no more kitchen time
+
+_lock = threading.Lock()
+_cache = None # ((order seq, menu version), monotonic time, schedule)
+
+def _order_time(order):
+    return _parse_time(order.order_date) or datetime.datetime.max
+
+def _parse_time(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+
+def _make_batches(queue, items, menu):
+    # Batches in the order their first order joined the queue
+    prep = {item.name: item for item in menu}
+    batches = []
+    open_batches = {} # item name -> newest batch, filled up before another is started
+    for order in queue:
+        for line in items.get(order.order_id, []):
+            info = prep.get(line.item_name)
+            size = max(info.batch_size or 1, 1) if info else 1
+            left = line.quantity
+            while left > 0:
+                batch = open_batches.get(line.item_name)
+                if batch is None or batch['quantity'] >= size:
+                    batch = {'item_name': line.item_name,
+                             'station': (info.station if info else None) or db.DEFAULT_STATION,
+                             'prep_seconds': (info.prep_seconds if info else None) or db.DEFAULT_PREP_SECONDS,
+                             'quantity': 0, 'orders': []}
+                    batches.append(batch)
+                    open_batches[line.item_name] = batch
+                take = min(left, size - batch['quantity'])
+                batch['quantity'] += take
+                if order.order_id not in batch['orders']:
+                    batch['orders'].append(order.order_id)
+                left -= take
+    return batches
+
+def _release_time(order, preparing_since, now):
+    # Earliest moment work on the order can start
+    placed = _parse_time(order.order_date)
+    if order.status == "Preparing":
+        return _parse_time(preparing_since.get(order.order_id)) or placed or now
+    return max(placed or now, now)
+
+def build_schedule(orders, items, menu, stations, now=None, preparing_since=None):
+    # orders: [Order], items: {order_id: [OrderItem]}, menu: [MenuItem], stations: {station: slots},
+    # preparing_since: {order_id: "YYYY-MM-DD HH:MM:SS"} local time each order went to "Preparing".
+    # Returns {'computed_at', 'batches': [batch] by start time, 'eta': {order_id: datetime},
+    # 'sequence': [order_id] by ETA}; batch = {'item_name', 'station', 'prep_seconds',
+    # 'quantity', 'orders', 'start', 'end'}
+    now = now or datetime.datetime.now()
+    queue = sorted((o for o in orders if o.status in QUEUED_STATUSES),
+                   key=lambda o: (QUEUED_STATUSES.index(o.status), _order_time(o), o.order_id))
+    batches = _make_batches(queue, items, menu)
+    release = {o.order_id: _release_time(o, preparing_since or {}, now) for o in queue}
+
+    free_at = {station: [datetime.datetime.min] * max(slots, 1) for station, slots in stations.items()}
+    eta = {}
+    for batch in batches:
+        slots = free_at.setdefault(batch['station'], [datetime.datetime.min])
+        slot = min(range(len(slots)), key=slots.__getitem__)
+        # A batch cooks once every order in it has been started
+        batch['start'] = max([slots[slot]] + [release[order_id] for order_id in batch['orders']])
+        end = batch['start'] + datetime.timedelta(seconds=batch['prep_seconds'])
+        batch['end'] = slots[slot] = max(end, now)
+        for order_id in batch['orders']:
+            eta[order_id] = max(eta.get(order_id, batch['end']), batch['end'])
+    # Orders with nothing on the menu to cook are ready right away
+    for order in queue:
+        eta.setdefault(order.order_id, now)
+
+    return {
+        'computed_at': now,
+        'batches': sorted(batches, key=lambda b: (b['start'], b['station'])),
+        'eta': eta,
+        'sequence': sorted(eta, key=lambda order_id: (eta[order_id], order_id))
+    }
+
+def get_schedule():
+    global _cache
+    seq = (db.get_latest_order_seq(), db.get_menu_version())
+    with _lock:
+        if _cache is not None:
+            age = time.monotonic() - _cache[1]
+            if age < MIN_INTERVAL_SECONDS or (_cache[0] == seq and age < MAX_AGE_SECONDS):
+                return _cache[2]
+    orders = db.get_orders(role="staff", statuses=QUEUED_STATUSES)
+    order_ids = [o.order_id for o in orders]
+    schedule = build_schedule(orders, db.get_order_items_bulk(order_ids), db.get_menu_items(),
+                              db.get_kitchen_stations(), preparing_since=db.get_preparing_since(order_ids))
+    with _lock:
+        _cache = (seq, time.monotonic(), schedule)
+    return schedule
+
+def get_order_eta(order_id):
+    # Predicted ready time, or None when the order is not waiting on the kitchen
+    return get_schedule()['eta'].get(order_id)
+
+def invalidate():
+    # Menu prep settings and stations do not show up in the order feed
+    global _cache
+    with _lock:
+        _cache = None
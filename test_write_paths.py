@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+import database as db
+
+# Concurrency checks for the write paths. Each test runs against a fresh
+# database in a temp directory.
+
+THREADS = 16
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    db.close_connections()
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "canteen.db"))
+    monkeypatch.setattr(db, "ARCHIVE_PATH", None)
+    monkeypatch.setattr(db, "GROUP_COMMIT", False)
+    monkeypatch.setattr(db, "STOCK_LEDGER", False)
+    db.init_db()
+    yield
+    db.close_connections()
+
+def _menu_stock(item_id):
+    with db.read_connection() as conn:
+        return conn.execute("SELECT stock FROM menu WHERE id = ?", (item_id,)).fetchone()[0]
+
+def _run_threads(target, count=THREADS):
+    # Starts count threads together and returns their results (or exceptions) in order
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = target(i)
+        except Exception as e:
+            results[i] = e
+    # Daemons, so a caller stuck forever fails the test instead of hanging pytest
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 30
+    for thread in threads:
+        thread.join(timeout=max(deadline - time.monotonic(), 0))
+    assert not any(thread.is_alive() for thread in threads), "a caller is still waiting"
+    return results
+
+def _order(item, qty=1):
+    cart = [{'id': item.id, 'name': item.name, 'price': item.price, 'qty': qty}]
+    return db.place_order(None, "Test", "9999999999", cart, item.price * qty, "Cash", "")
+
+@pytest.mark.parametrize("group_commit", [False, True])
+@pytest.mark.parametrize("ledger", [False, True])
+def test_last_unit_sells_once(fresh_db, group_commit, ledger):
+    item = db.get_menu_items()[0]
+    db.update_menu_stock_direct(item.id, 1)
+    if group_commit:
+        db.start_group_commit()
+    if ledger:
+        db.start_stock_ledger()
+
+    results = _run_threads(lambda i: _order(item))
+
+    assert not [r for r in results if isinstance(r, Exception)]
+    assert sum(r['ok'] for r in results) == 1
+    assert all(r['lines'][0]['status'] == "short" for r in results if not r['ok'])
+    db.stop_stock_ledger()
+    db.stop_group_commit()
+    assert _menu_stock(item.id) == 0
+
+def test_stop_group_commit_leaves_no_caller_waiting(fresh_db):
+    item = db.get_menu_items()[0]
+    db.update_menu_stock_direct(item.id, 10**6)
+    done = threading.Event()
+
+    def write(i):
+        if i == 0:
+            # Stop and restart the writer over and over while the others keep writing
+            try:
+                for _ in range(50):
+                    db.start_group_commit()
+                    time.sleep(0.002)
+                    db.stop_group_commit()
+            finally:
+                done.set()
+            return None
+        placed = []
+        while not done.is_set():
+            placed.append(_order(item)['ok'])
+        return placed
+
+    results = _run_threads(write)
+    # Writes queued before a stop commit, later ones run directly; none may hang or fail
+    assert not [r for r in results if isinstance(r, Exception)]
+    assert all(all(r) for r in results[1:])
+    assert not db.get_write_queue_stats()['running']
+
+def test_allocated_ids_are_unique_across_threads(fresh_db):
+    results = _run_threads(lambda i: [db.allocate_order_id(7) for _ in range(200)])
+    ids = [order_id for batch in results for order_id in batch]
+    assert len(ids) == len(set(ids)) == THREADS * 200
+
+def test_allocate_without_reserve(fresh_db):
+    assert db.allocate_order_id(reserve=False) is None
+    assert db.prefetch_order_id_block(10)
+    ids = [db.allocate_order_id(reserve=False) for _ in range(10)]
+    assert None not in ids and len(set(ids)) == 10
+    assert db.allocate_order_id(reserve=False) is None
+
+def test_ledger_stock_matches_menu_after_stop(fresh_db):
+    items = db.get_menu_items()[:3]
+    for item in items:
+        db.update_menu_stock_direct(item.id, 25)
+    db.start_stock_ledger()
+
+    results = _run_threads(lambda i: [_order(items[(i + n) % len(items)], qty=1 + n % 2) for n in range(6)])
+
+    assert not [r for r in results if isinstance(r, Exception)]
+    sold = {item.id: 0 for item in items}
+    for batch in results:
+        for result in batch:
+            if result['ok']:
+                line = result['lines'][0]
+                sold[line['id']] += line['qty']
+    db.stop_stock_ledger()
+    for item in items:
+        assert _menu_stock(item.id) == 25 - sold[item.id] >= 0
+    with db.read_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM stock_pending").fetchone()[0] == 0